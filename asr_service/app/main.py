@@ -1,10 +1,15 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from typing import List
+from typing import Callable, List, Optional, Tuple
 from faster_whisper import WhisperModel
+from common.autotune import autotune, cpu_count, load_or_tune, thread_grid
 from common.logger import logger
+from common.tracing import Trace
+from .vad import SpeechRegions, detect_speech
 import time
 
 logger.info("Service started")
@@ -13,9 +18,27 @@ logger.info("Service started")
 DEFAULT_SR = int(os.getenv("ASR_SR", "16000"))
 MAX_SECONDS = float(os.getenv("ASR_MAX_SECONDS", "15"))
 MODEL_NAME = os.getenv("ASR_MODEL", "tiny.en")
+# VAD перед моделью: обрезка тишины и пропуск полностью тихих клипов
+ASR_VAD = os.getenv("ASR_VAD", "1") == "1"
+ASR_VAD_FLOOR_DB = float(os.getenv("ASR_VAD_FLOOR_DB", "-50"))
+ASR_VAD_PAD_MS = int(os.getenv("ASR_VAD_PAD_MS", "250"))
+# Число pre-fork процессов (python -m app.main). CTranslate2 нельзя создавать
+# до fork, поэтому модель строится в каждом воркере: памяти это не экономит
+ASR_PROCESSES = int(os.getenv("ASR_PROCESSES", "1"))
+# Потоки CTranslate2 (0 — по умолчанию) и параллельные распознавания
+ASR_CPU_THREADS = int(os.getenv("ASR_CPU_THREADS", "0"))
+ASR_NUM_WORKERS = int(os.getenv("ASR_NUM_WORKERS", "1"))
+# Калибровка потоков при старте, результат кэшируется в ASR_TUNE_FILE
+ASR_AUTOTUNE = os.getenv("ASR_AUTOTUNE", "0") == "1"
+ASR_LATENCY_TARGET_MS = float(os.getenv("ASR_LATENCY_TARGET_MS", "2000"))
+ASR_TUNE_FILE = os.getenv("ASR_TUNE_FILE", "/opt/models/asr_tuning.json")
 
 app = FastAPI(title="asr-service", version="0.1.0")
 _model = None
+_model_path: Optional[str] = None
+_executor = None
+_calibrated = False
+tuning = {"threads": ASR_CPU_THREADS, "workers": ASR_NUM_WORKERS, "source": "env"}
 
 
 @app.middleware("http")
@@ -37,12 +60,106 @@ async def log_http_errors(request: Request, call_next):
     return response
 
 
+@app.on_event("startup")
+async def calibrate_on_startup():
+    if ASR_AUTOTUNE:
+        get_model()
+
+
+def fetch_model() -> str:
+    """Скачивает веса в локальный кэш без создания модели.
+
+    В pre-fork режиме вызывается в родителе: CTranslate2 нельзя запускать
+    до fork, а воркеры затем читают уже скачанные файлы.
+    """
+    global _model_path
+    if _model_path is None:
+        if os.path.isdir(MODEL_NAME):
+            _model_path = MODEL_NAME
+        else:
+            from faster_whisper import download_model
+
+            _model_path = download_model(MODEL_NAME)
+    return _model_path
+
+
+def build_model(threads: int, workers: int):
+    return WhisperModel(
+        _model_path or MODEL_NAME,
+        device="cpu",
+        compute_type="int8",
+        cpu_threads=threads,
+        num_workers=workers,
+    )
+
+
+def calibration_audio(seconds: float = 5.0) -> np.ndarray:
+    """Синтетический «голос» для калибровки: гармоники с огибающей слогов."""
+    t = np.arange(int(seconds * DEFAULT_SR)) / DEFAULT_SR
+    phase = 2 * np.pi * np.cumsum(120 + 30 * np.sin(2 * np.pi * 0.7 * t)) / DEFAULT_SR
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    return (0.25 * voiced * envelope).astype(np.float32)
+
+
+def tune_threads() -> dict:
+    audio = calibration_audio()
+
+    def build(threads: int, workers: int):
+        model = build_model(threads, workers)
+
+        def run_once():
+            segments, _ = model.transcribe(audio, language="en", vad_filter=False)
+            list(segments)
+
+        return run_once
+
+    # При pre-fork ядра делятся между процессами
+    cpus = max(1, cpu_count() // max(1, ASR_PROCESSES))
+    key = f"{MODEL_NAME}|cpus={cpus}|target={ASR_LATENCY_TARGET_MS}"
+    return load_or_tune(
+        ASR_TUNE_FILE,
+        key,
+        lambda: autotune(build, ASR_LATENCY_TARGET_MS, thread_grid(cpus)),
+    )
+
+
+def calibrate(tune: Callable[[], dict]):
+    """Один раз за процесс применяет результат подбора потоков."""
+    global _calibrated
+    if _calibrated:
+        return
+    _calibrated = True
+    try:
+        tuning.update(tune())
+    except Exception as e:
+        logger.error(f"Thread autotune failed, using defaults: {e}")
+
+
+def prepare_prefork():
+    """Подготовка в pre-fork родителе: скачать веса и подобрать потоки.
+
+    Замеры строят модели CTranslate2, поэтому идут в одноразовом процессе;
+    воркеры наследуют ``tuning`` через fork и строят модель уже с ним.
+    """
+    from common.prefork import run_in_child
+
+    fetch_model()
+    if ASR_AUTOTUNE:
+        calibrate(lambda: run_in_child(tune_threads))
+
+
 def get_model():
     global _model
     if _model is None:
-        logger.info(f"Loading Whisper model: {MODEL_NAME}")
+        if ASR_AUTOTUNE:
+            calibrate(tune_threads)
+        logger.info(
+            f"Loading Whisper model: {MODEL_NAME} "
+            f"(threads={tuning['threads']}, workers={tuning['workers']})"
+        )
         try:
-            _model = WhisperModel(MODEL_NAME, device="cpu", compute_type="int8")
+            _model = build_model(tuning["threads"], tuning["workers"])
             logger.info("Whisper model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load Whisper model: {e}")
@@ -50,6 +167,16 @@ def get_model():
     return _model
 
 
+def get_executor() -> ThreadPoolExecutor:
+    """Пул распознавания: число потоков равно ``num_workers`` модели."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, tuning["workers"]), thread_name_prefix="asr"
+        )
+    return _executor
+
+
 def pcm_s16le_bytes_to_float32_mono(
     data: bytes, channels: int, sample_rate: int
 ) -> np.ndarray:
@@ -68,11 +195,14 @@ def pcm_s16le_bytes_to_float32_mono(
 async def stt_bytes(
     request: Request, sr: int = DEFAULT_SR, ch: int = 1, lang: str = "en"
 ):
-    body = await request.body()
+    trace = Trace.from_headers("asr", request.headers)
+    with trace.span("read_body"):
+        body = await request.body()
     if not body:
         raise HTTPException(status_code=400, detail="Empty body")
 
-    audio = pcm_s16le_bytes_to_float32_mono(body, channels=ch, sample_rate=sr)
+    with trace.span("decode"):
+        audio = pcm_s16le_bytes_to_float32_mono(body, channels=ch, sample_rate=sr)
     max_samples = int(MAX_SECONDS * sr)
     if audio.shape[0] > max_samples:
         raise HTTPException(
@@ -82,51 +212,122 @@ async def stt_bytes(
     duration = len(audio) / sr
     logger.info(f"Processing audio: {len(body)} bytes, {duration:.2f}s, lang={lang}")
 
-    try:
-        model = get_model()
-        segments_iter, _ = model.transcribe(audio, language=lang, vad_filter=False)
-
-        text_parts: List[str] = []
-        segments_out: List[dict] = []
-        segment_count = 0
-
-        for seg in segments_iter:
-            text_parts.append(seg.text)
-            segments_out.append(
-                {
-                    "start_ms": int(seg.start * 1000),
-                    "end_ms": int(seg.end * 1000),
-                    "text": seg.text.strip(),
-                }
-            )
-            segment_count += 1
-
-        result_text = " ".join(t.strip() for t in text_parts).strip()
-
-        # Логируем результат транскрипции
-        if result_text:
-            logger.info(
-                f"Transcription completed: '{result_text[:50]}"
-                f"{'...' if len(result_text) > 50 else ''}' "
-                f"({segment_count} segments)"
+    regions = None
+    vad_stats = None
+    if ASR_VAD:
+        vad_start = time.perf_counter()
+        regions = detect_speech(
+            audio, sr, floor_db=ASR_VAD_FLOOR_DB, pad_ms=ASR_VAD_PAD_MS
+        )
+        trace.record("vad", vad_start)
+        vad_stats = {
+            "speech_ms": int(regions.speech_samples * 1000 / sr),
+            "trimmed_ms": int((len(audio) - regions.speech_samples) * 1000 / sr),
+            "vad_ms": round((time.perf_counter() - vad_start) * 1000, 2),
+        }
+        logger.info(
+            f"VAD: speech {vad_stats['speech_ms']}ms, "
+            f"trimmed {vad_stats['trimmed_ms']}ms in {vad_stats['vad_ms']}ms"
+        )
+        if regions.is_silent():
+            logger.warning("No speech detected in audio, skipping model")
+            trace.finish()
+            return JSONResponse(
+                {"text": "", "segments": [], "vad": vad_stats},
+                headers=trace.headers(),
             )
-        else:
-            logger.warning("No speech detected in audio")
+        audio = regions.extract(audio)
 
+    try:
+        result_text, segments_out = await asyncio.get_running_loop().run_in_executor(
+            get_executor(), transcribe, audio, lang, regions, trace
+        )
     except Exception as e:
         logger.error(f"Transcription failed: {e}")
         raise HTTPException(
             status_code=500, detail=f"Transcription error: {str(e)}"
         ) from e
 
-    return JSONResponse(
-        {
-            "text": result_text,
-            "segments": segments_out,
-        }
-    )
+    result = {
+        "text": result_text,
+        "segments": segments_out,
+    }
+    if vad_stats is not None:
+        result["vad"] = vad_stats
+    trace.finish()
+    return JSONResponse(result, headers=trace.headers())
+
+
+def transcribe(
+    audio: np.ndarray,
+    lang: str,
+    regions: Optional[SpeechRegions] = None,
+    trace: Optional[Trace] = None,
+) -> Tuple[str, List[dict]]:
+    """Распознаёт аудио; при ``regions`` таймкоды переводятся в шкалу
+    исходного (необрезанного) аудио."""
+    trace = trace or Trace("asr")
+    with trace.span("model_load"):
+        model = get_model()
+    transcribe_start = time.perf_counter()
+    segments_iter, _ = model.transcribe(audio, language=lang, vad_filter=False)
+
+    text_parts: List[str] = []
+    segments_out: List[dict] = []
+    segment_count = 0
+
+    for seg in segments_iter:
+        start, end = seg.start, seg.end
+        if regions is not None:
+            start = regions.to_original(start)
+            end = regions.to_original(end, end=True)
+        text_parts.append(seg.text)
+        segments_out.append(
+            {
+                "start_ms": int(start * 1000),
+                "end_ms": int(end * 1000),
+                "text": seg.text.strip(),
+            }
+        )
+        segment_count += 1
+
+    result_text = " ".join(t.strip() for t in text_parts).strip()
+    # Whisper декодирует лениво, поэтому этап включает обход сегментов
+    trace.record("transcribe", transcribe_start)
+
+    # Логируем результат транскрипции
+    if result_text:
+        logger.info(
+            f"Transcription completed: '{result_text[:50]}"
+            f"{'...' if len(result_text) > 50 else ''}' "
+            f"({segment_count} segments)"
+        )
+    else:
+        logger.warning("No speech detected in audio")
+    return result_text, segments_out
+
+
+@app.get("/tuning")
+async def get_tuning():
+    return tuning
 
 
 @app.get("/healthz")
 async def healthz():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "worker": os.getenv("WORKER_ID", "0"),
+        "pid": os.getpid(),
+    }
+
+
+if __name__ == "__main__":
+    from common.prefork import run_prefork
+
+    run_prefork(
+        app,
+        port=int(os.getenv("ASR_PORT", "8081")),
+        workers=ASR_PROCESSES,
+        preload=prepare_prefork,
+        init_worker=get_model,
+    )
@@ -0,0 +1,100 @@
+"""Дешёвый VAD по энергии кадра и частоте пересечений нуля (NumPy).
+
+Используется перед Whisper, чтобы не тратить время энкодера на тишину:
+тишина по краям и длинные паузы вырезаются, а таймкоды сегментов
+пересчитываются обратно в шкалу исходного аудио.
+"""
+
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+
+@dataclass
+class SpeechRegions:
+    """Участки речи в сэмплах исходного аудио: ``[(start, end), ...]``."""
+
+    regions: List[Tuple[int, int]]
+    sample_rate: int
+
+    @property
+    def speech_samples(self) -> int:
+        return sum(end - start for start, end in self.regions)
+
+    def is_silent(self) -> bool:
+        return not self.regions
+
+    def extract(self, audio: np.ndarray) -> np.ndarray:
+        if not self.regions:
+            return audio[:0]
+        return np.concatenate([audio[start:end] for start, end in self.regions])
+
+    def to_original(self, seconds: float, end: bool = False) -> float:
+        """Переводит время в склеенном аудио во время исходного аудио.
+
+        Точка на стыке двух участков относится к началу следующего участка,
+        а при ``end=True`` (конец сегмента) — к концу предыдущего.
+        """
+        sample = seconds * self.sample_rate
+        offset = 0
+        for start, stop in self.regions:
+            length = stop - start
+            if sample < offset + length or (end and sample == offset + length):
+                return (start + max(0.0, sample - offset)) / self.sample_rate
+            offset += length
+        last_end = self.regions[-1][1] if self.regions else 0
+        return last_end / self.sample_rate
+
+
+def frame_features(audio: np.ndarray, frame_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Энергия кадра в dBFS и доля пересечений нуля."""
+    n_frames = max(1, -(-len(audio) // frame_len))
+    padded = np.zeros(n_frames * frame_len, dtype=np.float32)
+    padded[: len(audio)] = audio
+    frames = padded.reshape(n_frames, frame_len)
+    energy_db = 10.0 * np.log10(np.mean(frames**2, axis=1) + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / frame_len
+    return energy_db, zcr
+
+
+def detect_speech(
+    audio: np.ndarray,
+    sample_rate: int,
+    frame_ms: int = 30,
+    floor_db: float = -50.0,
+    margin_db: float = 10.0,
+    pad_ms: int = 250,
+) -> SpeechRegions:
+    """Находит участки речи.
+
+    Порог — шум (10-й перцентиль энергии кадров) плюс ``margin_db``, но не
+    ниже ``floor_db`` и не выше пика минус 25 dB, чтобы сплошная речь не
+    отсекалась. Тихие кадры с высокой частотой пересечений нуля (глухие
+    согласные) тоже считаются речью. Каждый участок расширяется на ``pad_ms``;
+    паузы короче ``2 * pad_ms`` сохраняются.
+    """
+    frame_len = max(1, sample_rate * frame_ms // 1000)
+    if len(audio) == 0:
+        return SpeechRegions([], sample_rate)
+
+    energy_db, zcr = frame_features(audio, frame_len)
+    noise_db = np.percentile(energy_db, 10)
+    threshold = max(floor_db, min(noise_db + margin_db, energy_db.max() - 25.0))
+    voiced = energy_db >= threshold
+    unvoiced = (energy_db >= threshold - 10.0) & (zcr >= 0.3) & (energy_db > floor_db)
+    speech = voiced | unvoiced
+    if not speech.any():
+        return SpeechRegions([], sample_rate)
+
+    pad = max(0, pad_ms // frame_ms)
+    if pad:
+        speech = np.convolve(speech, np.ones(2 * pad + 1), mode="same") > 0
+
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * frame_len
+    ends = np.minimum(np.flatnonzero(edges == -1) * frame_len, len(audio))
+    return SpeechRegions(
+        [(int(s), int(e)) for s, e in zip(starts, ends, strict=True)], sample_rate
+    )
@@ -0,0 +1,125 @@
+"""Бенчмарк VAD на смешанном наборе речь/тишина.
+
+Запуск из корня репозитория:
+
+    python -m asr_service.benchmarks.bench_vad [--model tiny.en] [--wav a.wav ...]
+
+Без ``--wav`` используется синтетический набор: «речеподобные» фрагменты
+(гармоники с огибающей слогов и шумовые согласные) с тишиной по краям и
+паузами внутри, а также полностью тихие клипы. Если установлен
+faster-whisper, замеряется время ``transcribe`` на полном и обрезанном аудио.
+"""
+
+import argparse
+import time
+import wave
+from typing import List, Tuple
+
+import numpy as np
+
+from asr_service.app.vad import detect_speech
+
+SR = 16000
+
+
+def speech_like(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    t = np.arange(int(seconds * SR)) / SR
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SR
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    fricatives = rng.normal(0, 0.3, len(t)) * (syllables < 0.2)
+    return (0.25 * voiced * syllables + 0.05 * fricatives).astype(np.float32)
+
+
+def silence(seconds: float, rng: np.random.Generator) -> np.ndarray:
+    return rng.normal(0, 1e-4, int(seconds * SR)).astype(np.float32)
+
+
+def synthetic_set(rng: np.random.Generator) -> List[Tuple[str, np.ndarray]]:
+    clips = []
+    for lead, speech, pause, tail in [
+        (0.0, 3.0, 0.0, 0.0),
+        (1.5, 2.0, 0.0, 2.0),
+        (0.5, 1.5, 3.0, 1.0),
+        (3.0, 1.0, 0.0, 4.0),
+        (0.2, 4.0, 1.0, 0.2),
+    ]:
+        parts = [silence(lead, rng), speech_like(speech, rng)]
+        if pause:
+            parts += [silence(pause, rng), speech_like(speech, rng)]
+        parts.append(silence(tail, rng))
+        clips.append((f"speech {lead}/{speech}/{pause}/{tail}", np.concatenate(parts)))
+    for seconds in (2.0, 8.0):
+        clips.append((f"silence {seconds}s", silence(seconds, rng)))
+    return clips
+
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as wf:
+        if wf.getframerate() != SR or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16 kHz mono s16le WAV supported")
+        raw = wf.readframes(wf.getnframes())
+    return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+
+
+def time_transcribe(model, audio: np.ndarray) -> float:
+    if len(audio) == 0:
+        return 0.0
+    start = time.perf_counter()
+    segments, _ = model.transcribe(audio, language="en", vad_filter=False)
+    list(segments)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--wav", nargs="*", default=[], help="16 kHz mono WAV files")
+    parser.add_argument("--model", default="tiny.en", help="Whisper model name")
+    parser.add_argument("--no-model", action="store_true", help="Only time VAD")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    clips = [(p, read_wav(p)) for p in args.wav] or synthetic_set(rng)
+
+    model = None
+    if not args.no_model:
+        try:
+            from faster_whisper import WhisperModel
+
+            model = WhisperModel(args.model, device="cpu", compute_type="int8")
+        except Exception as e:
+            print(f"Model unavailable ({e}), timing VAD only")
+
+    totals = np.zeros(4)
+    print(
+        f"{'clip':32} {'audio_s':>8} {'speech_s':>8} {'vad_ms':>7} "
+        f"{'full_s':>7} {'vad+trim_s':>10}"
+    )
+    for name, audio in clips:
+        start = time.perf_counter()
+        regions = detect_speech(audio, SR)
+        vad_s = time.perf_counter() - start
+        trimmed = regions.extract(audio)
+        full_s = trim_s = float("nan")
+        if model is not None:
+            full_s = time_transcribe(model, audio)
+            trim_s = vad_s + time_transcribe(model, trimmed)
+            totals += [len(audio) / SR, len(trimmed) / SR, full_s, trim_s]
+        else:
+            totals[:2] += [len(audio) / SR, len(trimmed) / SR]
+        print(
+            f"{name:32} {len(audio) / SR:8.2f} {len(trimmed) / SR:8.2f} "
+            f"{vad_s * 1000:7.2f} {full_s:7.3f} {trim_s:10.3f}"
+        )
+
+    print(f"\naudio kept: {totals[1] / totals[0]:.0%} of {totals[0]:.1f}s")
+    if model is not None:
+        print(
+            f"model time: {totals[2]:.2f}s full vs {totals[3]:.2f}s with VAD "
+            f"({1 - totals[3] / totals[2]:.0%} saved)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
+import os
+
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
 from asr_service.app.main import app
+from asr_service.app.vad import SpeechRegions
 import numpy as np
 
 client = TestClient(app)
 
 
+def tone(seconds: float, sr: int = 16000) -> np.ndarray:
+    t = np.arange(int(seconds * sr)) / sr
+    return (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype("<i2")
+
+
 def test_healthz_ok():
     r = client.get("/healthz")
     assert r.status_code == 200
@@ -32,7 +40,7 @@ def test_stt_success(mock_whisper):
     seg_mock.end = 1.2
     mock_model.transcribe.return_value = ([seg_mock], {"language": "en"})
 
-    pcm_data = (np.zeros(16000, dtype="<i2")).tobytes()
+    pcm_data = tone(1.0).tobytes()
 
     r = client.post("/api/stt/bytes", data=pcm_data)
     assert r.status_code == 200
@@ -40,3 +48,94 @@ def test_stt_success(mock_whisper):
     assert j["text"] == "hello"
     assert len(j["segments"]) == 1
     assert j["segments"][0]["start_ms"] == 0
+
+
+@patch("asr_service.app.main.get_model")
+def test_stt_silence_skips_model(mock_get_model):
+    pcm_data = np.zeros(16000, dtype="<i2").tobytes()
+
+    r = client.post("/api/stt/bytes", data=pcm_data)
+    assert r.status_code == 200
+    j = r.json()
+    assert j["text"] == ""
+    assert j["segments"] == []
+    assert j["vad"]["speech_ms"] == 0
+    assert j["vad"]["trimmed_ms"] == 1000
+    mock_get_model.assert_not_called()
+
+
+@patch("asr_service.app.main.get_model")
+def test_stt_trims_silence_and_keeps_timestamps(mock_get_model):
+    seg_mock = MagicMock()
+    seg_mock.text = "hello"
+    seg_mock.start = 0.25
+    seg_mock.end = 1.25
+    mock_get_model.return_value.transcribe.return_value = ([seg_mock], {})
+
+    silence = np.zeros(16000, dtype="<i2")
+    pcm_data = np.concatenate([silence, tone(1.0), silence]).tobytes()
+
+    r = client.post("/api/stt/bytes", data=pcm_data)
+    assert r.status_code == 200
+    j = r.json()
+    audio = mock_get_model.return_value.transcribe.call_args[0][0]
+    # 1 с речи + по 250 мс запаса с каждой стороны
+    assert abs(len(audio) - 24000) <= 480
+    assert abs(j["segments"][0]["start_ms"] - 1000) <= 30
+    assert abs(j["segments"][0]["end_ms"] - 2000) <= 30
+    assert j["vad"]["trimmed_ms"] >= 1400
+
+
+def test_speech_regions_join_maps_start_to_next_region():
+    # Два участка по 1 с: [1 с, 2 с) и [5 с, 6 с) исходного аудио
+    regions = SpeechRegions([(16000, 32000), (80000, 96000)], 16000)
+    assert regions.to_original(0.5) == 1.5
+    assert regions.to_original(1.0) == 5.0
+    assert regions.to_original(1.0, end=True) == 2.0
+    assert regions.to_original(1.5) == 5.5
+    assert regions.to_original(2.0, end=True) == 6.0
+
+
+@patch("asr_service.app.main.get_model")
+def test_stt_returns_request_id_and_server_timing(mock_get_model):
+    mock_get_model.return_value.transcribe.return_value = ([], {})
+
+    r = client.post(
+        "/api/stt/bytes",
+        data=tone(0.5).tobytes(),
+        headers={"X-Request-ID": "req-123"},
+    )
+    assert r.status_code == 200
+    assert r.headers["X-Request-ID"] == "req-123"
+    timing = r.headers["Server-Timing"]
+    for stage in ("read_body", "decode", "vad", "model_load", "transcribe"):
+        assert f"{stage};dur=" in timing
+
+
+def test_tuning_endpoint_reports_settings():
+    r = client.get("/tuning")
+    assert r.status_code == 200
+    j = r.json()
+    assert {"threads", "workers", "source"} <= set(j)
+
+
+def test_prepare_prefork_tunes_in_throwaway_process():
+    from asr_service.app import main
+
+    def fake_tune():
+        return {"threads": 3, "workers": 2, "source": "measured", "pid": os.getpid()}
+
+    saved = dict(main.tuning)
+    with (
+        patch.object(main, "ASR_AUTOTUNE", True),
+        patch.object(main, "_calibrated", False),
+        patch.object(main, "fetch_model"),
+        patch.object(main, "tune_threads", fake_tune),
+    ):
+        main.prepare_prefork()
+        result = dict(main.tuning)
+    main.tuning.clear()
+    main.tuning.update(saved)
+
+    assert (result["threads"], result["workers"]) == (3, 2)
+    assert result["pid"] != os.getpid()
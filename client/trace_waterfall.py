@@ -0,0 +1,54 @@
+import argparse
+import json
+from collections import defaultdict
+
+
+def load_traces(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    traces[record["request_id"]].append(record)
+    return traces
+
+
+def print_waterfall(request_id: str, records, width: int = 60):
+    spans = []
+    for record in records:
+        for span in record["spans"]:
+            # Тайминги, полученные из Server-Timing, не имеют отметки начала
+            if span.get("remote"):
+                continue
+            start = record["ts"] * 1000 + span["start_ms"]
+            spans.append((start, span["dur_ms"], f"{record['service']}.{span['name']}"))
+    if not spans:
+        return
+
+    origin = min(s[0] for s in spans)
+    total = max(s[0] + s[1] for s in spans) - origin or 1.0
+    print(f"\n{request_id}  total {total:.1f}ms")
+    for start, dur, name in sorted(spans):
+        offset = int((start - origin) / total * width)
+        length = max(1, int(dur / total * width))
+        bar = " " * offset + "#" * min(length, width - offset)
+        print(f"  {name:28} {start - origin:8.1f} {dur:8.1f}ms |{bar:{width}}|")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print per-request waterfalls")
+    parser.add_argument("logs", nargs="+", help="TRACE_LOG files of the services")
+    parser.add_argument("--request-id", help="Show only this request")
+    args = parser.parse_args()
+
+    traces = load_traces(args.logs)
+    for request_id, records in traces.items():
+        if args.request_id and request_id != args.request_id:
+            continue
+        print_waterfall(request_id, records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Подбор числа потоков инференса при старте.
+
+Перебираются пары (intra-op потоки, параллельные воркеры), для каждой
+замеряются пропускная способность и p95 задержки на синтетических данных.
+Выбирается пара с лучшей пропускной способностью среди укладывающихся в
+целевую задержку; результат сохраняется в JSON и при следующем старте
+с тем же ключом (модель, число ядер, цель) читается без замеров.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from common.logger import logger
+
+RunOnce = Callable[[], None]
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def thread_grid(cpus: int) -> List[Tuple[int, int]]:
+    """Пары (threads, workers) с ``threads * workers <= cpus``."""
+    sizes = sorted({n for n in (1, 2, 4, 8, 16, 32, 64, cpus) if n <= cpus})
+    return [(t, w) for t in sizes for w in sizes if t * w <= cpus]
+
+
+def measure(run_once: RunOnce, workers: int, requests: int) -> Tuple[float, float]:
+    """Пропускная способность (запросов/с) и p95 задержки (мс)."""
+    run_once()  # прогрев
+
+    def timed(_):
+        started = time.perf_counter()
+        run_once()
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        latencies = sorted(pool.map(timed, range(requests)))
+    elapsed = time.perf_counter() - started
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    return requests / elapsed, p95
+
+
+def autotune(
+    build: Callable[[int, int], RunOnce],
+    latency_target_ms: float,
+    grid: Optional[List[Tuple[int, int]]] = None,
+) -> dict:
+    """``build(threads, workers)`` настраивает модель и возвращает функцию
+    одного запроса."""
+    trials = []
+    for threads, workers in grid or thread_grid(cpu_count()):
+        try:
+            run_once = build(threads, workers)
+            throughput, p95 = measure(run_once, workers, max(4, 2 * workers))
+        except Exception as e:
+            logger.error(f"Autotune trial {threads}x{workers} failed: {e}")
+            continue
+        logger.info(
+            f"Autotune trial threads={threads} workers={workers}: "
+            f"{throughput:.2f} req/s, p95 {p95:.0f}ms"
+        )
+        trials.append(
+            {
+                "threads": threads,
+                "workers": workers,
+                "throughput_rps": round(throughput, 3),
+                "p95_ms": round(p95, 1),
+            }
+        )
+    if not trials:
+        raise RuntimeError("All autotune trials failed")
+
+    within = [t for t in trials if t["p95_ms"] <= latency_target_ms]
+    if within:
+        best = max(within, key=lambda t: t["throughput_rps"])
+    else:
+        best = min(trials, key=lambda t: t["p95_ms"])
+    return {**best, "latency_target_ms": latency_target_ms, "trials": trials}
+
+
+def load_or_tune(path: str, key: str, tune: Callable[[], dict]) -> dict:
+    """Читает сохранённый результат для ``key`` или запускает ``tune()``."""
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved.get("key") == key:
+                logger.info(f"Using saved thread settings from {path}")
+                return {**saved, "source": "saved"}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable tuning file {path}: {e}")
+
+    started = time.time()
+    result = {**tune(), "key": key, "tuned_at": started}
+    result["tune_seconds"] = round(time.time() - started, 1)
+    logger.info(
+        f"Autotune picked threads={result['threads']} workers={result['workers']} "
+        f"in {result['tune_seconds']}s"
+    )
+    if path:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=2)
+        except OSError as e:
+            logger.error(f"Failed to save tuning file {path}: {e}")
+    return {**result, "source": "measured"}
@@ -0,0 +1,217 @@
+"""Pre-fork запуск uvicorn: несколько воркеров на общем сокете под надзором
+родителя.
+
+Модель, загруженная в родителе (``preload``), достаётся воркерам через
+fork(): страницы весов общие, пока их никто не пишет (copy-on-write). Это
+возможно, только если к моменту fork в родителе нет пулов нативных потоков:
+fork() копирует лишь вызывающий поток, и в ребёнке инференс зависнет на пуле
+без потоков. Torch запускает свой пул на первой параллельной операции, поэтому
+модель torch можно загрузить в родителе без инференса. CTranslate2 запускает
+потоки в конструкторе модели — такую модель строят в воркере (``init_worker``),
+и веса у каждого воркера свои. Работу, которой в родителе нужен инференс
+(калибровка), выполняет ``run_in_child``.
+"""
+
+import asyncio
+import gc
+import multiprocessing
+import os
+import pickle
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional, TypeVar
+
+import uvicorn
+
+from common.logger import logger
+
+T = TypeVar("T")
+
+
+def run_in_child(fn: Callable[[], T]) -> T:
+    """Выполняет ``fn`` в одноразовом дочернем процессе и возвращает результат.
+
+    Нативные пулы потоков, запущенные ``fn``, умирают вместе с ребёнком,
+    поэтому родитель после этого можно безопасно форкать.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            try:
+                payload = pickle.dumps((True, fn()))
+            except BaseException as e:
+                payload = pickle.dumps((False, f"{type(e).__name__}: {e}"))
+            with os.fdopen(write_fd, "wb") as f:
+                f.write(payload)
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        data = f.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError(f"Child process {pid} exited without a result")
+    ok, value = pickle.loads(data)
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(
+    app,
+    sock: socket.socket,
+    index: int,
+    heartbeats,
+    interval: float,
+    init_worker: Optional[Callable[[], object]],
+):
+    os.environ["WORKER_ID"] = str(index)
+    if init_worker is not None:
+        started = time.time()
+        try:
+            init_worker()
+            logger.info(f"Worker {index} initialized in {time.time() - started:.1f}s")
+        except Exception as e:
+            # Как и в однопроцессном режиме: воркер отвечает, а модель
+            # повторно пытается загрузиться при запросе
+            logger.error(f"Worker {index} init failed: {e}")
+
+    async def heartbeat():
+        async def beat():
+            while True:
+                heartbeats[index] = time.time()
+                await asyncio.sleep(interval)
+
+        asyncio.get_running_loop().create_task(beat())
+
+    app.router.add_event_handler("startup", heartbeat)
+    config = uvicorn.Config(app, log_level=os.getenv("LOG_LEVEL", "info").lower())
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class _Supervisor:
+    """Следит за воркерами: перезапускает упавшие и убивает зависшие."""
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        interval: float,
+        init_worker: Optional[Callable[[], object]] = None,
+    ):
+        self.app = app
+        self.sock = sock
+        self.interval = interval
+        self.init_worker = init_worker
+        self.heartbeats = multiprocessing.Array("d", workers, lock=False)
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int):
+        self.heartbeats[index] = time.time()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _run_worker(
+                    self.app,
+                    self.sock,
+                    index,
+                    self.heartbeats,
+                    self.interval,
+                    self.init_worker,
+                )
+            finally:
+                os._exit(0)
+        self.children[pid] = index
+        logger.info(f"Worker {index} started (pid {pid})")
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            if index is not None and not self.stopping:
+                logger.error(f"Worker {index} (pid {pid}) exited ({status})")
+                self.spawn(index)
+
+    def kill_stale(self, timeout: float):
+        now = time.time()
+        for pid, index in list(self.children.items()):
+            if now - self.heartbeats[index] > timeout:
+                logger.error(f"Worker {index} (pid {pid}) unresponsive, killing")
+                os.kill(pid, signal.SIGKILL)
+
+    def shutdown(self):
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in list(self.children):
+            os.waitpid(pid, 0)
+        self.children.clear()
+
+
+def run_prefork(
+    app,
+    port: int,
+    workers: int,
+    preload: Optional[Callable[[], object]] = None,
+    init_worker: Optional[Callable[[], object]] = None,
+    host: str = "0.0.0.0",
+    heartbeat_interval: float = 1.0,
+    heartbeat_timeout: float = 60.0,
+):
+    """Запускает ``workers`` процессов uvicorn на общем сокете.
+
+    ``preload`` вызывается в родителе до fork: загрузка модели без инференса
+    и без запуска нативных пулов потоков. ``init_worker`` вызывается в каждом
+    воркере после fork (настройка потоков или построение модели, которую
+    нельзя создавать до fork); он должен укладываться в ``heartbeat_timeout``. Родитель
+    перезапускает упавшие воркеры и убивает зависшие — те, чей heartbeat
+    из event loop не обновлялся дольше ``heartbeat_timeout`` секунд.
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    if preload is not None:
+        started = time.time()
+        preload()
+        logger.info(f"Preload in parent finished in {time.time() - started:.1f}s")
+    # Объекты модели из preload не попадут в обход GC в воркерах, и сборщик
+    # не будет писать в их заголовки, копируя общие страницы.
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind(host, port)
+    supervisor = _Supervisor(app, sock, workers, heartbeat_interval, init_worker)
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+
+    for index in range(workers):
+        supervisor.spawn(index)
+
+    while not supervisor.stopping:
+        time.sleep(heartbeat_interval)
+        supervisor.reap()
+        supervisor.kill_stale(heartbeat_timeout)
+
+    supervisor.shutdown()
+    sock.close()
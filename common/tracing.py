@@ -0,0 +1,117 @@
+"""Трассировка запросов: request id между сервисами и тайминги этапов.
+
+Каждый сервис заводит ``Trace`` на запрос, отмечает этапы через
+``trace.span(...)`` и отдаёт их наружу заголовком ``Server-Timing`` или
+в финальном сообщении WebSocket. При заданном ``TRACE_LOG`` трасса
+дописывается JSON-строкой в этот файл — по нему собираются водопады
+(см. ``client/trace_waterfall.py``).
+"""
+
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Mapping, Optional
+
+from common.logger import logger
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+
+
+def parse_server_timing(value) -> Dict[str, float]:
+    """``"a;dur=1.5, b;dur=2"`` -> ``{"a": 1.5, "b": 2.0}``"""
+    if not isinstance(value, str):
+        return {}
+    timings = {}
+    for entry in value.split(","):
+        name, *params = [p.strip() for p in entry.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                try:
+                    timings[name] = float(param[4:])
+                except ValueError:
+                    pass
+    return timings
+
+
+class Trace:
+    """Этапы одного запроса в одном сервисе."""
+
+    def __init__(self, service: str, request_id: Optional[str] = None):
+        self.service = service
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.spans: List[dict] = []
+
+    @classmethod
+    def from_headers(cls, service: str, headers: Mapping[str, str]) -> "Trace":
+        return cls(service, headers.get(REQUEST_ID_HEADER))
+
+    def record(self, name: str, started: float, ended: Optional[float] = None):
+        """Добавляет этап по отметкам ``time.perf_counter()``; повторный
+        этап с тем же именем суммируется."""
+        ended = time.perf_counter() if ended is None else ended
+        dur_ms = (ended - started) * 1000
+        for span in self.spans:
+            if span["name"] == name:
+                span["dur_ms"] += dur_ms
+                return
+        self.spans.append(
+            {
+                "name": name,
+                "start_ms": (started - self.started) * 1000,
+                "dur_ms": dur_ms,
+            }
+        )
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def merge(self, prefix: str, timings: Mapping[str, float]):
+        """Добавляет тайминги другого сервиса (без отметок начала)."""
+        for name, dur_ms in timings.items():
+            self.spans.append(
+                {"name": f"{prefix}.{name}", "dur_ms": dur_ms, "remote": True}
+            )
+
+    def timings(self) -> Dict[str, float]:
+        return {span["name"]: round(span["dur_ms"], 2) for span in self.spans}
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{name};dur={dur_ms:.1f}" for name, dur_ms in self.timings().items()
+        )
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            REQUEST_ID_HEADER: self.request_id,
+            "Server-Timing": self.server_timing(),
+        }
+
+    def stats(self) -> dict:
+        return {"request_id": self.request_id, "timings": self.timings()}
+
+    def finish(self):
+        """Пишет трассу в локальный span log, если он включён."""
+        if not TRACE_LOG:
+            return
+        record = {
+            "request_id": self.request_id,
+            "service": self.service,
+            "ts": self.wall_started,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "spans": self.spans,
+        }
+        try:
+            with open(TRACE_LOG, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write trace log: {e}")
@@ -0,0 +1,174 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+
+from common.logger import logger
+
+
+def parse_urls(value: str) -> List[str]:
+    """Разбирает список адресов через запятую."""
+    return [u.strip() for u in value.split(",") if u.strip()]
+
+
+def health_url(url: str) -> str:
+    """ws://host:port/ws/tts -> http://host:port/healthz"""
+    parts = urlsplit(url)
+    scheme = {"ws": "http", "wss": "https"}.get(parts.scheme, parts.scheme)
+    return urlunsplit((scheme, parts.netloc, "/healthz", "", ""))
+
+
+class Upstream:
+    """Одна реплика сервиса и её состояние."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.health_url = health_url(url)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        # Пассивное исключение (ошибки запросов) и исключение по /healthz
+        # снимаются независимо: успешная проверка не отменяет пассивное
+        self.ejected_until = 0.0
+        self.probe_ejected_until = 0.0
+        self.total = 0
+        self.failures = 0
+
+    def available(self, now: float) -> bool:
+        return now >= max(self.ejected_until, self.probe_ejected_until)
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "healthy": self.available(time.monotonic()),
+            "total": self.total,
+            "failures": self.failures,
+        }
+
+
+class Lease:
+    """Выданная реплика; вызывающий может пометить запрос как неудачный."""
+
+    def __init__(self, upstream: Upstream):
+        self.upstream = upstream
+        self.failed = False
+
+    @property
+    def url(self) -> str:
+        return self.upstream.url
+
+
+class UpstreamPool:
+    """Балансировка по наименьшему числу активных запросов.
+
+    Реплика исключается пассивно после ``max_failures`` ошибок подряд
+    и активно — по неуспешному ``/healthz``; возвращается в ротацию через
+    ``eject_seconds``. Успешная проверка досрочно снимает только исключение,
+    наложенное проверкой.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        max_failures: int = 3,
+        eject_seconds: float = 10.0,
+        latency_window: int = 100,
+    ):
+        if not urls:
+            raise ValueError("At least one upstream URL required")
+        self.upstreams = [Upstream(u) for u in urls]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.latencies: Deque[float] = deque(maxlen=latency_window)
+        self.hedged = 0
+        self._rr = 0
+
+    def pick(self, exclude: Optional[Upstream] = None) -> Optional[Upstream]:
+        now = time.monotonic()
+        candidates = [u for u in self.upstreams if u is not exclude]
+        if not candidates:
+            return None
+        healthy = [u for u in candidates if u.available(now)]
+        # Если исключены все — пробуем хоть кого-то, а не отказываем сразу
+        pool = healthy or candidates
+        self._rr += 1
+        offset = self._rr % len(pool)
+        rotated = pool[offset:] + pool[:offset]
+        return min(rotated, key=lambda u: u.outstanding)
+
+    def eject(self, upstream: Upstream, reason: str, probe: bool = False):
+        now = time.monotonic()
+        if upstream.available(now):
+            logger.warning(f"Upstream {upstream.url} ejected: {reason}")
+        if probe:
+            upstream.probe_ejected_until = now + self.eject_seconds
+        else:
+            upstream.ejected_until = now + self.eject_seconds
+
+    def report(self, upstream: Upstream, ok: bool):
+        upstream.total += 1
+        if ok:
+            upstream.consecutive_failures = 0
+            return
+        upstream.failures += 1
+        upstream.consecutive_failures += 1
+        if upstream.consecutive_failures >= self.max_failures:
+            self.eject(upstream, f"{upstream.consecutive_failures} errors in a row")
+
+    @asynccontextmanager
+    async def acquire(
+        self, upstream: Optional[Upstream] = None
+    ) -> AsyncIterator[Lease]:
+        lease = Lease(upstream or self.pick())
+        lease.upstream.outstanding += 1
+        try:
+            yield lease
+        except Exception:
+            self.report(lease.upstream, ok=False)
+            raise
+        else:
+            self.report(lease.upstream, ok=not lease.failed)
+        finally:
+            lease.upstream.outstanding -= 1
+
+    def observe_latency(self, seconds: float):
+        self.latencies.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def probe(self, timeout: float = 2.0):
+        for upstream in self.upstreams:
+            try:
+                resp = await asyncio.to_thread(
+                    requests.get, upstream.health_url, timeout=timeout
+                )
+                ok = resp.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                was_available = upstream.available(time.monotonic())
+                upstream.probe_ejected_until = 0.0
+                if not was_available and upstream.available(time.monotonic()):
+                    logger.info(f"Upstream {upstream.url} is healthy again")
+            else:
+                self.eject(upstream, "health check failed", probe=True)
+
+    async def probe_forever(self, interval: float):
+        while True:
+            await self.probe()
+            await asyncio.sleep(interval)
+
+    def snapshot(self) -> dict:
+        return {
+            "upstreams": [u.snapshot() for u in self.upstreams],
+            "p95_ms": None if self.p95() is None else round(self.p95() * 1000, 1),
+            "hedged": self.hedged,
+        }
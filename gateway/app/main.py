@@ -6,17 +6,69 @@ import requests
 import websockets
 import os
 import time
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Optional, Union
 from common.logger import logger
+from common.tracing import REQUEST_ID_HEADER, Trace, parse_server_timing
+from .balancer import Upstream, UpstreamPool, parse_urls
 
 logger.info("Service started")
 
 
 TTS_WS_URL = os.getenv("TTS_WS_URL", "ws://localhost:8082/ws/tts")
 ASR_URL = os.getenv("ASR_URL", "http://localhost:8081/api/stt/bytes")
+# Списки реплик через запятую; по умолчанию — одиночные адреса выше
+TTS_WS_URLS = parse_urls(os.getenv("TTS_WS_URLS", TTS_WS_URL))
+ASR_URLS = parse_urls(os.getenv("ASR_URLS", ASR_URL))
+# Сколько входящих сообщений от TTS держим в буфере на одну сессию
+TTS_WS_MAX_QUEUE = int(os.getenv("TTS_WS_MAX_QUEUE", "16"))
+# Сколько сегментов одного запроса синтезируется параллельно
+TTS_SEGMENT_CONCURRENCY = int(os.getenv("TTS_SEGMENT_CONCURRENCY", "4"))
+SAMPLE_RATE = 16000
+UPSTREAM_MAX_FAILS = int(os.getenv("UPSTREAM_MAX_FAILS", "3"))
+UPSTREAM_EJECT_SECONDS = float(os.getenv("UPSTREAM_EJECT_SECONDS", "10"))
+UPSTREAM_PROBE_INTERVAL = float(os.getenv("UPSTREAM_PROBE_INTERVAL", "5"))
+# Хеджирование ASR: повтор на второй реплике после задержки ~p95
+ASR_HEDGE = os.getenv("ASR_HEDGE", "0") == "1"
+ASR_HEDGE_MIN_MS = float(os.getenv("ASR_HEDGE_MIN_MS", "50"))
+ASR_HEDGE_DEFAULT_MS = float(os.getenv("ASR_HEDGE_DEFAULT_MS", "1000"))
 
 app = FastAPI(title="gateway", version="0.1.0")
 
+tts_pool = UpstreamPool(
+    TTS_WS_URLS, max_failures=UPSTREAM_MAX_FAILS, eject_seconds=UPSTREAM_EJECT_SECONDS
+)
+asr_pool = UpstreamPool(
+    ASR_URLS, max_failures=UPSTREAM_MAX_FAILS, eject_seconds=UPSTREAM_EJECT_SECONDS
+)
+_probe_tasks = []
+
+# Счётчики WebSocket-сессий TTS (отдаются через /metrics); rejected —
+# TTS отклонил запрос клиента (пустой текст, не JSON), реплика не виновата
+session_stats = {
+    "active": 0,
+    "completed": 0,
+    "abandoned": 0,
+    "rejected": 0,
+    "failed": 0,
+}
+
+
+@app.on_event("startup")
+async def start_probes():
+    if UPSTREAM_PROBE_INTERVAL > 0:
+        for pool in (tts_pool, asr_pool):
+            _probe_tasks.append(
+                asyncio.create_task(pool.probe_forever(UPSTREAM_PROBE_INTERVAL))
+            )
+
+
+@app.on_event("shutdown")
+async def stop_probes():
+    for task in _probe_tasks:
+        task.cancel()
+    _probe_tasks.clear()
+
 
 @app.middleware("http")
 async def log_http_errors(request: Request, call_next):
@@ -45,21 +97,29 @@ async def safe_send_json(ws: WebSocket, data: dict):
         pass
 
 
+# Подтверждения управляющих сообщений (barge-in), которые отдаём клиенту
+CONTROL_ACKS = {"cancelled", "replaced"}
+# Ошибки TTS, вызванные запросом клиента, и код закрытия при отказе (1003)
+CLIENT_ERRORS = {"text required"}
+CLOSE_UNSUPPORTED_DATA = 1003
+
+
 async def forward_to_tts(
     client_ws: WebSocket, tts_ws: websockets.WebSocketClientProtocol
 ):
-    """Пересылает сообщения от клиента к TTS."""
+    """Пересылает сообщения от клиента к TTS, включая управляющие
+    ``{"type": "cancel"}`` и ``{"type": "replace", ...}``."""
     try:
         while True:
             data = await client_ws.receive_text()
             try:
                 payload = json.loads(data)
                 if "segments" in payload and "text" not in payload:
-                    segments = payload.get("segments", [])
-                    text = " ".join(
+                    segments = payload.pop("segments") or []
+                    payload["text"] = " ".join(
                         seg.get("text", "") for seg in segments if seg.get("text")
                     )
-                    await tts_ws.send(json.dumps({"text": text}))
+                    await tts_ws.send(json.dumps(payload))
                 else:
                     await tts_ws.send(data)
             except json.JSONDecodeError:
@@ -70,53 +130,117 @@ async def forward_to_tts(
         return
 
 
+def merge_tts_stats(trace: Trace, end_frame: dict):
+    """Добавляет в трассу тайминги TTS из его финального сообщения."""
+    stats = end_frame.get("stats")
+    if isinstance(stats, dict):
+        trace.merge("tts", stats.get("timings") or {})
+
+
+def parse_frame(message: str) -> dict:
+    """Текстовое сообщение TTS как словарь (пустой, если это не JSON-объект)."""
+    try:
+        data = json.loads(message)
+    except json.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
 async def forward_to_client(
-    client_ws: WebSocket, tts_ws: websockets.WebSocketClientProtocol
-):
-    """Пересылает сообщения от TTS к клиенту."""
+    client_ws: WebSocket,
+    tts_ws: websockets.WebSocketClientProtocol,
+    trace: Optional[Trace] = None,
+) -> str:
+    """Пересылает сообщения от TTS к клиенту. Финальное ``end`` дополняется
+    статистикой трассы (gateway + TTS), ошибки TTS передаются клиенту как есть.
+
+    Возвращает исход: completed (получен ``end``), rejected (TTS отклонил
+    запрос клиента: ошибка валидации или закрытие с кодом 1003), failed
+    (TTS закрыл соединение без ``end`` после своей ошибки или обрыва) или
+    abandoned (клиент отключился).
+    """
+    trace = trace or Trace("gateway")
+    upstream_error = None
     try:
         async for message in tts_ws:
             if isinstance(message, bytes):
                 await client_ws.send_bytes(message)
-            else:
-                try:
-                    data = json.loads(message)
-                    if data.get("type") == "end":
-                        await client_ws.send_text(json.dumps({"type": "end"}))
-                        break
-                except Exception:
-                    pass
+                continue
+            data = parse_frame(message)
+            if data.get("type") == "end":
+                merge_tts_stats(trace, data)
+                await client_ws.send_text(
+                    json.dumps({"type": "end", "stats": trace.stats()})
+                )
+                return "completed"
+            if "error" in data:
+                upstream_error = data["error"]
+                logger.error(f"TTS error: {upstream_error}")
+                await client_ws.send_text(message)
+            elif data.get("type") in CONTROL_ACKS:
+                await client_ws.send_text(message)
     except WebSocketDisconnect:
-        return
+        return "abandoned"
     except Exception as e:
         logger.error(f"Error in forward_to_client: {e}")
-        return
-
-
-async def proxy_tts_ws(client_ws: WebSocket, tts_ws_url: str):
-    """Основной прокси для WebSocket TTS."""
+        return "failed"
+    if (
+        upstream_error in CLIENT_ERRORS
+        or getattr(tts_ws, "close_code", None) == CLOSE_UNSUPPORTED_DATA
+    ):
+        return "rejected"
+    if upstream_error is None:
+        logger.error("TTS closed the connection without end")
+        await safe_send_json(client_ws, {"error": "TTS closed without end"})
+    return "failed"
+
+
+async def proxy_tts_ws(
+    client_ws: WebSocket,
+    tts_ws_url: str,
+    first_msg: str,
+    trace: Optional[Trace] = None,
+) -> str:
+    """Основной прокси для WebSocket TTS.
+
+    Как только одна из сторон завершилась (клиент отключился или TTS прислал
+    end), парная корутина отменяется, а соединение с TTS закрывается, чтобы
+    сервис прекратил синтез для этой сессии.
+
+    Возвращает исход сессии: completed, abandoned, rejected или failed;
+    только failed учитывается балансировщиком как ошибка реплики.
+    """
+    trace = trace or Trace("gateway")
+    session_stats["active"] += 1
+    outcome = "failed"
     try:
-        async with websockets.connect(tts_ws_url) as tts_ws:
+        connect_start = time.perf_counter()
+        async with websockets.connect(
+            tts_ws_url,
+            max_queue=TTS_WS_MAX_QUEUE,
+            extra_headers={REQUEST_ID_HEADER: trace.request_id},
+        ) as tts_ws:
+            trace.record("tts_connect", connect_start)
             logger.info("Connected to TTS service")
+            await tts_ws.send(first_msg)
 
+            to_tts = asyncio.create_task(forward_to_tts(client_ws, tts_ws))
+            to_client = asyncio.create_task(forward_to_client(client_ws, tts_ws, trace))
             try:
-                first_msg = await client_ws.receive_text()
-                await tts_ws.send(first_msg)
-            except Exception as e:
-                logger.error(f"Failed to read initial message: {e}")
-                await safe_send_json(client_ws, {"error": str(e)})
-                return
-
-            try:
-                await asyncio.gather(
-                    forward_to_tts(client_ws, tts_ws),
-                    forward_to_client(client_ws, tts_ws),
-                    return_exceptions=True,
+                done, pending = await asyncio.wait(
+                    {to_tts, to_client}, return_when=asyncio.FIRST_COMPLETED
                 )
+                outcome = to_client.result() if to_client in done else "abandoned"
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
             except Exception as e:
-                logger.error(f"Error in proxy gather: {e}")
+                logger.error(f"Error in proxy tasks: {e}")
                 await safe_send_json(client_ws, {"error": str(e)})
             finally:
+                for task in (to_tts, to_client):
+                    task.cancel()
+                await tts_ws.close()
                 try:
                     await client_ws.close()
                 except Exception:
@@ -129,21 +253,368 @@ async def proxy_tts_ws(client_ws: WebSocket, tts_ws_url: str):
             await client_ws.close(code=1011)
         except Exception:
             pass
+    finally:
+        session_stats["active"] -= 1
+        session_stats[outcome] += 1
+        trace.finish()
+        if outcome == "abandoned":
+            logger.info("TTS session abandoned by client, upstream closed")
+    return outcome
+
+
+async def synthesize_segment(text: str, queue: asyncio.Queue, request_id: str):
+    """Синтезирует один сегмент на отдельном соединении и складывает чанки
+    в очередь; ``None`` в очереди — конец сегмента, строка перед ним —
+    текст ошибки."""
+    try:
+        async with (
+            tts_pool.acquire() as lease,
+            websockets.connect(
+                lease.url,
+                max_queue=TTS_WS_MAX_QUEUE,
+                extra_headers={REQUEST_ID_HEADER: request_id},
+            ) as tts_ws,
+        ):
+            await tts_ws.send(json.dumps({"text": text}))
+            async for message in tts_ws:
+                if isinstance(message, bytes):
+                    await queue.put(message)
+                    continue
+                data = parse_frame(message)
+                if data.get("type") == "end":
+                    return
+                if "error" in data:
+                    raise RuntimeError(data["error"])
+            raise RuntimeError("TTS closed without end")
+    except Exception as e:
+        logger.error(f"Segment synthesis failed: {e}")
+        await queue.put(str(e) or type(e).__name__)
+    finally:
+        await queue.put(None)
+
+
+def silence_until(ms, offset: int) -> bytes:
+    """Тишина от ``offset`` (в сэмплах) до отметки ``ms``."""
+    gap = int(ms) * SAMPLE_RATE // 1000 - offset
+    return b"\x00\x00" * gap if gap > 0 else b""
+
+
+async def segment_items(
+    index: int, seg: dict, queue: asyncio.Queue, offset: int, keep_timing: bool
+) -> AsyncGenerator[Union[bytes, dict], None]:
+    """Маркер, аудио и паузы одного сегмента. Ошибка синтеза отдаётся
+    маркером с полем ``error`` на той позиции, где аудио сегмента оборвалось."""
+    if keep_timing and seg.get("start_ms") is not None:
+        pad = silence_until(seg["start_ms"], offset)
+        offset += len(pad) // 2
+        yield pad
+    item = await queue.get()
+    if not isinstance(item, str):
+        yield {"type": "segment", "index": index, "offset_samples": offset}
+    while item is not None:
+        if isinstance(item, str):
+            yield {
+                "type": "segment",
+                "index": index,
+                "offset_samples": offset,
+                "error": item,
+            }
+        else:
+            yield item
+            offset += len(item) // 2
+        item = await queue.get()
+    if keep_timing and seg.get("end_ms") is not None:
+        yield silence_until(seg["end_ms"], offset)
+
+
+async def synthesize_segments(
+    segments: List[dict], keep_timing: bool = False, trace: Optional[Trace] = None
+) -> AsyncGenerator[Union[bytes, dict], None]:
+    """Параллельный синтез сегментов с отдачей строго по порядку.
+
+    Перед аудио каждого сегмента отдаётся маркер
+    ``{"type": "segment", "index": i, "offset_samples": n}``; у неудавшегося
+    сегмента в маркере есть ``error``. Одновременно синтезируется и лежит
+    в буфере не больше ``TTS_SEGMENT_CONCURRENCY`` сегментов, считая от
+    отдаваемого: медленный клиент не заставляет держать в памяти весь
+    запрос. При ``keep_timing`` сегмент начинается не раньше ``start_ms``,
+    а после него тишина добивается до ``end_ms``.
+    """
+    trace = trace or Trace("gateway")
+    started = time.perf_counter()
+    items = [
+        (index, seg)
+        for index, seg in enumerate(segments)
+        if seg.get("text", "").strip()
+    ]
+    queues: List[asyncio.Queue] = [asyncio.Queue() for _ in items]
+    tasks: List[asyncio.Task] = []
+    window = max(1, TTS_SEGMENT_CONCURRENCY)
+    offset = 0
+    try:
+        for head, ((index, seg), queue) in enumerate(zip(items, queues, strict=True)):
+            while len(tasks) < min(len(items), head + window):
+                _, pending = items[len(tasks)]
+                tasks.append(
+                    asyncio.create_task(
+                        synthesize_segment(
+                            pending["text"], queues[len(tasks)], trace.request_id
+                        )
+                    )
+                )
+            async for item in segment_items(index, seg, queue, offset, keep_timing):
+                if isinstance(item, bytes):
+                    if not item:
+                        continue
+                    if not offset:
+                        trace.record("first_audio", started)
+                    offset += len(item) // 2
+                yield item
+        trace.record("segments", started)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def control_segments(control: dict) -> List[dict]:
+    """Сегменты из ``replace``: ``segments`` или ``text`` как один сегмент."""
+    segments = control.get("segments")
+    if isinstance(segments, list) and segments:
+        return segments
+    text = control.get("text")
+    return [{"text": text}] if isinstance(text, str) and text.strip() else []
+
+
+async def send_segments(
+    client_ws: WebSocket, segments: List[dict], keep_timing: bool, trace: Trace
+):
+    async with aclosing(synthesize_segments(segments, keep_timing, trace)) as stream:
+        async for item in stream:
+            if isinstance(item, bytes):
+                await client_ws.send_bytes(item)
+            else:
+                await client_ws.send_text(json.dumps(item))
+
+
+async def wait_segments_control(
+    client_ws: WebSocket, job: asyncio.Task
+) -> Optional[dict]:
+    """Ждёт окончания отдачи сегментов, принимая сообщения клиента.
 
+    Возвращает ``None``, если отдача завершилась, сообщение ``cancel`` или
+    ``replace``, либо ``{"type": "disconnect"}``, если клиент отключился.
+    """
+    receiver = None
+    try:
+        while not job.done():
+            if receiver is None:
+                receiver = asyncio.create_task(client_ws.receive_text())
+            await asyncio.wait({job, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not receiver.done():
+                continue
+            if receiver.exception() is not None:
+                return {"type": "disconnect"}
+            control = parse_frame(receiver.result())
+            receiver = None
+            kind = control.get("type")
+            if kind == "replace" and not control_segments(control):
+                await safe_send_json(client_ws, {"error": "segments required"})
+                continue
+            if kind in ("cancel", "replace"):
+                return control
+        return None
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+
+
+async def run_segments_session(
+    client_ws: WebSocket, payload: dict, trace: Trace
+) -> str:
+    segments = payload.get("segments") or []
+    keep_timing = bool(payload.get("keep_timing"))
+    while True:
+        job = asyncio.create_task(
+            send_segments(client_ws, segments, keep_timing, trace)
+        )
+        try:
+            control = await wait_segments_control(client_ws, job)
+        finally:
+            job.cancel()
+            await asyncio.gather(job, return_exceptions=True)
+        if control is None:
+            job.result()
+            break
+        if control["type"] == "disconnect":
+            return "abandoned"
+        if control["type"] == "cancel":
+            logger.info("Segments synthesis cancelled by client")
+            await client_ws.send_text(json.dumps({"type": "cancelled"}))
+            break
+        logger.info("Segments synthesis replaced by client")
+        await client_ws.send_text(json.dumps({"type": "replaced"}))
+        segments = control_segments(control)
+        keep_timing = bool(control.get("keep_timing", keep_timing))
+    await client_ws.send_text(json.dumps({"type": "end", "stats": trace.stats()}))
+    await client_ws.close()
+    return "completed"
+
+
+async def stream_segments_ws(
+    client_ws: WebSocket, payload: dict, trace: Optional[Trace] = None
+) -> str:
+    """Режим сегментов для /ws/tts: аудио и маркеры сегментов, затем end.
+
+    Как и в обычном режиме, клиент может прислать ``{"type": "cancel"}``
+    (ответ ``cancelled`` и ``end``) или ``{"type": "replace", "segments": ...}``
+    (ответ ``replaced``, синтез начинается заново); при отключении клиента
+    синтез сразу прекращается. Возвращает исход сессии.
+    """
+    trace = trace or Trace("gateway")
+    session_stats["active"] += 1
+    outcome = "failed"
+    try:
+        outcome = await run_segments_session(client_ws, payload, trace)
+    except WebSocketDisconnect:
+        outcome = "abandoned"
+    except asyncio.CancelledError:
+        # Сервер снимает обработчик отключившегося клиента
+        outcome = "abandoned"
+        raise
+    except Exception as e:
+        logger.error(f"Segments stream error: {e}")
+        await safe_send_json(client_ws, {"error": str(e)})
+    finally:
+        session_stats["active"] -= 1
+        session_stats[outcome] += 1
+        trace.finish()
+        if outcome == "abandoned":
+            logger.info("Segments session abandoned by client")
+    return outcome
 
-async def echo_bytes_stream(pcm_data: bytes) -> AsyncGenerator[bytes, None]:
+
+def segments_payload(message: str) -> Optional[dict]:
     try:
-        asr_resp = requests.post(
-            f"{ASR_URL}?sr=16000&ch=1&lang=en",
+        payload = json.loads(message)
+    except json.JSONDecodeError:
+        return None
+    if (
+        isinstance(payload, dict)
+        and payload.get("segments")
+        and not payload.get("text")
+    ):
+        return payload
+    return None
+
+
+async def asr_request(
+    pcm_data: bytes, upstream: Upstream, request_id: str
+) -> requests.Response:
+    async with asr_pool.acquire(upstream) as lease:
+        start_time = time.monotonic()
+        asr_resp = await asyncio.to_thread(
+            requests.post,
+            f"{lease.url}?sr=16000&ch=1&lang=en",
             data=pcm_data,
-            headers={"Content-Type": "application/octet-stream"},
+            headers={
+                "Content-Type": "application/octet-stream",
+                REQUEST_ID_HEADER: request_id,
+            },
             timeout=30,
         )
-        asr_resp.raise_for_status()
-        text = asr_resp.json().get("text", "").strip()
+        # 5xx — сбой реплики; 4xx (например, слишком длинное аудио) вызван
+        # запросом клиента и на исключение реплики не влияет
+        if asr_resp.status_code >= 500:
+            asr_resp.raise_for_status()
+        if asr_resp.ok:
+            asr_pool.observe_latency(time.monotonic() - start_time)
+    asr_resp.raise_for_status()
+    return asr_resp
+
+
+def _discard_result(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
+
+
+async def asr_attempt(
+    pcm_data: bytes, upstream: Upstream, trace: Optional[Trace] = None
+) -> dict:
+    """Одна попытка запроса к ASR.
+
+    HTTP-запрос в потоке нельзя прервать, поэтому отмена попытки (проигравший
+    хедж) не отменяет сам запрос: реплика остаётся занятой в балансировщике,
+    пока поток не вернётся.
+    """
+    trace = trace or Trace("gateway")
+    request = asyncio.ensure_future(asr_request(pcm_data, upstream, trace.request_id))
+    request.add_done_callback(_discard_result)
+    asr_resp = await asyncio.shield(request)
+    trace.merge("asr", parse_server_timing(asr_resp.headers.get("Server-Timing")))
+    return asr_resp.json()
+
+
+def asr_hedge_delay() -> float:
+    p95 = asr_pool.p95()
+    if p95 is None:
+        return ASR_HEDGE_DEFAULT_MS / 1000
+    return max(ASR_HEDGE_MIN_MS / 1000, p95)
+
+
+async def post_asr(pcm_data: bytes, trace: Optional[Trace] = None) -> dict:
+    """Запрос к ASR на наименее загруженную реплику.
+
+    При ``ASR_HEDGE=1`` и отсутствии ответа за ``asr_hedge_delay()`` тот же
+    запрос отправляется на вторую реплику; используется первый успешный ответ.
+    """
+    primary_upstream = asr_pool.pick()
+    primary = asyncio.create_task(asr_attempt(pcm_data, primary_upstream, trace))
+    hedge_upstream: Optional[Upstream] = None
+    if ASR_HEDGE:
+        hedge_upstream = asr_pool.pick(exclude=primary_upstream)
+    if hedge_upstream is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=asr_hedge_delay())
+    if done:
+        return primary.result()
+
+    asr_pool.hedged += 1
+    logger.info(f"Hedging ASR request to {hedge_upstream.url}")
+    pending = {
+        primary,
+        asyncio.create_task(asr_attempt(pcm_data, hedge_upstream, trace)),
+    }
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+    finally:
+        for task in pending:
+            task.cancel()
+    raise error
+
+
+async def echo_bytes_stream(text: str, trace: Trace) -> AsyncGenerator[bytes, None]:
+    """Озвучивает распознанный текст; этапы TTS попадают только в span log,
+    так как заголовки ответа к этому моменту уже отправлены."""
+    try:
         if not text:
             return
-        async with websockets.connect(TTS_WS_URL) as tts_ws:
+        connect_start = time.perf_counter()
+        async with (
+            tts_pool.acquire() as lease,
+            websockets.connect(
+                lease.url, extra_headers={REQUEST_ID_HEADER: trace.request_id}
+            ) as tts_ws,
+        ):
+            trace.record("tts_connect", connect_start)
             await tts_ws.send(json.dumps({"text": text}))
             async for message in tts_ws:
                 if isinstance(message, bytes):
@@ -152,17 +623,45 @@ async def echo_bytes_stream(pcm_data: bytes) -> AsyncGenerator[bytes, None]:
                     try:
                         data = json.loads(message)
                         if data.get("type") == "end":
+                            merge_tts_stats(trace, data)
                             break
                     except Exception:
                         pass
+            trace.record("tts", connect_start)
     except Exception:
         pass
+    finally:
+        trace.finish()
 
 
 @app.websocket("/ws/tts")
 async def ws_tts_proxy(websocket: WebSocket):
     await websocket.accept()
-    await proxy_tts_ws(websocket, TTS_WS_URL)
+    trace = Trace.from_headers("gateway", websocket.headers)
+    try:
+        first_msg = await websocket.receive_text()
+    except WebSocketDisconnect:
+        session_stats["abandoned"] += 1
+        return
+    except Exception as e:
+        # Например, бинарный первый кадр: receive_text() падает с KeyError
+        logger.error(f"Failed to read initial message: {e}")
+        session_stats["rejected"] += 1
+        await safe_send_json(websocket, {"error": "text required"})
+        try:
+            await websocket.close(code=CLOSE_UNSUPPORTED_DATA)
+        except Exception:
+            pass
+        return
+
+    payload = segments_payload(first_msg)
+    if payload is not None:
+        await stream_segments_ws(websocket, payload, trace)
+        return
+
+    async with tts_pool.acquire() as lease:
+        if await proxy_tts_ws(websocket, lease.url, first_msg, trace) == "failed":
+            lease.failed = True
 
 
 @app.post("/api/echo-bytes")
@@ -174,11 +673,23 @@ async def echo_bytes(
             status_code=400, detail="Only sr=16000, ch=1, fmt=s16le supported"
         )
 
-    pcm_data = await request.body()
+    trace = Trace.from_headers("gateway", request.headers)
+    with trace.span("upload"):
+        pcm_data = await request.body()
     if not pcm_data:
         raise HTTPException(status_code=400, detail="Empty body")
+
+    text = ""
+    try:
+        with trace.span("asr"):
+            result = await post_asr(pcm_data, trace)
+        text = result.get("text", "").strip()
+    except Exception as e:
+        logger.error(f"ASR request failed: {e}")
     return StreamingResponse(
-        echo_bytes_stream(pcm_data), media_type="application/octet-stream"
+        echo_bytes_stream(text, trace),
+        media_type="application/octet-stream",
+        headers=trace.headers(),
     )
 
 
@@ -192,8 +703,11 @@ async def tts_segments(request: Request):
         text = " ".join(seg.get("text", "") for seg in segments if seg.get("text"))
         if not text.strip():
             raise HTTPException(status_code=400, detail="No text in segments")
+        trace = Trace.from_headers("gateway", request.headers)
         return StreamingResponse(
-            tts_segments_stream(text), media_type="application/octet-stream"
+            tts_segments_stream(segments, bool(data.get("keep_timing")), trace),
+            media_type="application/octet-stream",
+            headers={REQUEST_ID_HEADER: trace.request_id},
         )
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=400, detail="Invalid JSON") from e
@@ -201,22 +715,31 @@ async def tts_segments(request: Request):
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-async def tts_segments_stream(text: str) -> AsyncGenerator[bytes, None]:
+async def tts_segments_stream(
+    segments: List[dict], keep_timing: bool = False, trace: Optional[Trace] = None
+) -> AsyncGenerator[bytes, None]:
+    """PCM сегментов по порядку; маркеры в сыром PCM-потоке не передаются
+    (они доступны в режиме сегментов /ws/tts)."""
+    trace = trace or Trace("gateway")
+    stream = synthesize_segments(segments, keep_timing, trace)
     try:
-        async with websockets.connect(TTS_WS_URL) as tts_ws:
-            await tts_ws.send(json.dumps({"text": text}))
-            async for message in tts_ws:
-                if isinstance(message, bytes):
-                    yield message
-                else:
-                    try:
-                        data = json.loads(message)
-                        if data.get("type") == "end":
-                            break
-                    except Exception:
-                        pass
+        async for item in stream:
+            if isinstance(item, bytes):
+                yield item
     except Exception:
         pass
+    finally:
+        await stream.aclose()
+        trace.finish()
+
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "tts_sessions": dict(session_stats),
+        "tts_upstreams": tts_pool.snapshot(),
+        "asr_upstreams": asr_pool.snapshot(),
+    }
 
 
 @app.get("/healthz")
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from gateway.app import main
+from gateway.app.balancer import UpstreamPool, health_url, parse_urls
+
+
+def start_stub(text: str, delay: float = 0.0, healthy: bool = True, status: int = 200):
+    """Локальный ASR-заглушка на свободном порту."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply(200 if healthy else 503, {"status": "ok"})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            self._reply(status, {"text": text, "segments": []})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/stt/bytes"
+
+
+@pytest.fixture
+def stubs():
+    servers = []
+
+    def factory(*args, **kwargs):
+        server, url = start_stub(*args, **kwargs)
+        servers.append(server)
+        return url
+
+    yield factory
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_parse_and_health_url():
+    assert parse_urls("ws://a:1/ws/tts, ws://b:2/ws/tts,") == [
+        "ws://a:1/ws/tts",
+        "ws://b:2/ws/tts",
+    ]
+    assert health_url("ws://tts:8082/ws/tts") == "http://tts:8082/healthz"
+
+
+def test_pick_least_outstanding():
+    pool = UpstreamPool(["http://a", "http://b", "http://c"])
+    a, b, c = pool.upstreams
+    a.outstanding, b.outstanding, c.outstanding = 2, 0, 1
+    assert pool.pick() is b
+    assert pool.pick(exclude=b) is c
+
+
+def test_passive_ejection_after_failures():
+    pool = UpstreamPool(["http://a", "http://b"], max_failures=2, eject_seconds=60)
+    a, b = pool.upstreams
+
+    async def fail():
+        with pytest.raises(RuntimeError):
+            async with pool.acquire(a):
+                raise RuntimeError("boom")
+
+    asyncio.run(fail())
+    asyncio.run(fail())
+    assert not a.available(time.monotonic())
+    assert all(pool.pick() is b for _ in range(5))
+
+
+def test_active_probe_ejects_and_restores(stubs):
+    good = stubs("ok")
+    bad = stubs("ok", healthy=False)
+    pool = UpstreamPool([good, bad])
+
+    asyncio.run(pool.probe())
+    assert [u.snapshot()["healthy"] for u in pool.upstreams] == [True, False]
+
+    pool.upstreams[1].health_url = pool.upstreams[0].health_url
+    asyncio.run(pool.probe())
+    assert pool.upstreams[1].snapshot()["healthy"]
+
+
+def test_probe_keeps_passive_ejection(stubs):
+    pool = UpstreamPool([stubs("ok"), stubs("ok")], max_failures=1, eject_seconds=60)
+    a = pool.upstreams[0]
+    pool.report(a, ok=False)
+    assert not a.available(time.monotonic())
+
+    asyncio.run(pool.probe())
+    assert not a.available(time.monotonic())
+    assert pool.upstreams[1].available(time.monotonic())
+
+
+def test_asr_client_errors_do_not_eject(stubs):
+    pool = UpstreamPool([stubs("too long", status=400)], max_failures=2)
+
+    async def post():
+        with pytest.raises(requests.HTTPError):
+            await main.post_asr(b"\x00" * 3200)
+
+    with patch.object(main, "asr_pool", pool):
+        for _ in range(3):
+            asyncio.run(post())
+
+    upstream = pool.upstreams[0]
+    assert upstream.failures == 0
+    assert upstream.available(time.monotonic())
+    assert upstream.outstanding == 0
+
+
+def test_asr_server_errors_eject(stubs):
+    pool = UpstreamPool([stubs("crash", status=500)], max_failures=2)
+
+    async def post():
+        with pytest.raises(requests.HTTPError):
+            await main.post_asr(b"\x00" * 3200)
+
+    with patch.object(main, "asr_pool", pool):
+        for _ in range(2):
+            asyncio.run(post())
+
+    assert not pool.upstreams[0].available(time.monotonic())
+
+
+def test_asr_hedges_to_fast_replica(stubs):
+    slow = stubs("slow", delay=1.0)
+    fast = stubs("fast")
+    pool = UpstreamPool([slow, fast])
+    pool.pick = lambda exclude=None: (
+        pool.upstreams[1] if exclude is not None else pool.upstreams[0]
+    )
+
+    with (
+        patch.object(main, "asr_pool", pool),
+        patch.object(main, "ASR_HEDGE", True),
+        patch.object(main, "ASR_HEDGE_DEFAULT_MS", 50),
+    ):
+
+        async def timed():
+            start = time.monotonic()
+            result = await main.post_asr(b"\x00" * 3200)
+            elapsed = time.monotonic() - start
+            # Проигравший запрос ещё выполняется — реплика считается занятой
+            busy = pool.upstreams[0].outstanding
+            while pool.upstreams[0].outstanding and time.monotonic() - start < 3:
+                await asyncio.sleep(0.05)
+            return result, elapsed, busy
+
+        result, elapsed, busy = asyncio.run(timed())
+
+    assert result["text"] == "fast"
+    assert elapsed < 0.9
+    assert pool.hedged == 1
+    assert busy == 1
+    assert pool.upstreams[0].outstanding == 0
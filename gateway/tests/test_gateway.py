@@ -1,8 +1,15 @@
 # gateway/tests/test_gateway.py
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock, AsyncMock
 
-from gateway.app.main import app  # ← теперь путь к FastAPI-приложению
+from gateway.app import main
+from gateway.app.main import app, session_stats  # ← путь к FastAPI-приложению
 
 client = TestClient(app)
 
@@ -43,6 +50,36 @@ def test_echo_bytes_success(mock_post, mock_ws_connect):
     assert b"pcm_chunk" in r.content
 
 
+@patch("gateway.app.main.websockets.connect")
+@patch("gateway.app.main.requests.post")
+def test_echo_bytes_propagates_request_id_and_timing(mock_post, mock_ws_connect):
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {"text": "hello"}
+    mock_post.return_value.headers = {"Server-Timing": "transcribe;dur=42.0"}
+
+    mock_ws = AsyncMock()
+
+    async def fake_iter():
+        yield b"pcm_chunk"
+        yield '{"type": "end"}'
+
+    mock_ws.__aiter__.side_effect = lambda: fake_iter()
+    mock_ws_connect.return_value.__aenter__.return_value = mock_ws
+
+    r = client.post(
+        "/api/echo-bytes", data=b"\x00" * 3200, headers={"X-Request-ID": "req-9"}
+    )
+    assert r.status_code == 200
+    assert r.headers["X-Request-ID"] == "req-9"
+    timing = r.headers["Server-Timing"]
+    assert "upload;dur=" in timing
+    assert "asr;dur=" in timing
+    assert "asr.transcribe;dur=42.0" in timing
+    assert mock_post.call_args.kwargs["headers"]["X-Request-ID"] == "req-9"
+    extra_headers = mock_ws_connect.call_args.kwargs["extra_headers"]
+    assert extra_headers == {"X-Request-ID": "req-9"}
+
+
 @patch("gateway.app.main.websockets.connect")
 @patch("gateway.app.main.requests.post", side_effect=Exception("ASR failed"))
 def test_echo_bytes_asr_exception(mock_post, mock_ws_connect):
@@ -85,3 +122,294 @@ def test_tts_segments_tts_exception(mock_ws):
     r = client.post("/api/tts-segments", json=data)
     assert r.status_code == 200
     assert r.content == b""
+
+
+@patch("gateway.app.main.websockets.connect")
+def test_ws_tts_client_disconnect_closes_upstream(mock_ws_connect):
+    mock_ws = AsyncMock()
+
+    async def endless_iter():
+        while True:
+            yield b"chunk"
+            await asyncio.sleep(0.01)
+
+    mock_ws.__aiter__.side_effect = lambda: endless_iter()
+    mock_ws_connect.return_value.__aenter__.return_value = mock_ws
+    abandoned_before = session_stats["abandoned"]
+
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"text": "Hello"})
+        assert ws.receive_bytes() == b"chunk"
+
+    mock_ws.close.assert_awaited()
+    assert session_stats["abandoned"] == abandoned_before + 1
+    assert session_stats["active"] == 0
+    r = client.get("/metrics")
+    assert r.json()["tts_sessions"]["abandoned"] == session_stats["abandoned"]
+
+
+@patch("gateway.app.main.websockets.connect")
+def test_ws_tts_relays_control_messages(mock_ws_connect):
+    mock_ws = AsyncMock()
+    sent = []
+    cancelled = asyncio.Event()
+
+    async def fake_send(message):
+        sent.append(json.loads(message))
+        if sent[-1].get("type") == "cancel":
+            cancelled.set()
+
+    async def fake_iter():
+        yield b"chunk"
+        await cancelled.wait()
+        yield '{"type": "cancelled"}'
+        yield '{"type": "end", "stats": {"timings": {"synthesis": 12.5}}}'
+
+    mock_ws.send.side_effect = fake_send
+    mock_ws.__aiter__.side_effect = lambda: fake_iter()
+    mock_ws_connect.return_value.__aenter__.return_value = mock_ws
+
+    headers = {"X-Request-ID": "req-7"}
+    with client.websocket_connect("/ws/tts", headers=headers) as ws:
+        ws.send_json({"text": "Hello"})
+        assert ws.receive_bytes() == b"chunk"
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled"}
+        end_msg = ws.receive_json()
+
+    assert sent[-1] == {"type": "cancel"}
+    assert end_msg["type"] == "end"
+    assert end_msg["stats"]["request_id"] == "req-7"
+    assert end_msg["stats"]["timings"]["tts.synthesis"] == 12.5
+    assert "tts_connect" in end_msg["stats"]["timings"]
+    extra_headers = mock_ws_connect.call_args.kwargs["extra_headers"]
+    assert extra_headers == {"X-Request-ID": "req-7"}
+
+
+class FakeSegmentTTS:
+    """TTS-заглушка: отдаёт текст сегмента как PCM после задержки."""
+
+    delays = {"first": 0.3, "second": 0.3, "slow": 5.0}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def send(self, message):
+        self.text = json.loads(message)["text"]
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.delays.get(self.text, 0))
+        if self.text == "broken":
+            yield '{"error": "synthesis crashed"}'
+            return
+        yield self.text.encode()
+        yield '{"type": "end"}'
+
+
+@patch(
+    "gateway.app.main.websockets.connect",
+    side_effect=lambda *args, **kwargs: FakeSegmentTTS(),
+)
+def test_tts_segments_parallel_and_ordered(mock_ws_connect):
+    data = {"segments": [{"text": "first"}, {"text": "second"}]}
+    start = time.monotonic()
+    r = client.post("/api/tts-segments", json=data)
+    elapsed = time.monotonic() - start
+    assert r.status_code == 200
+    assert r.content == b"firstsecond"
+    assert mock_ws_connect.call_count == 2
+    assert elapsed < 0.55
+
+
+@patch(
+    "gateway.app.main.websockets.connect",
+    side_effect=lambda *args, **kwargs: FakeSegmentTTS(),
+)
+def test_ws_tts_segments_markers_and_timing(mock_ws_connect):
+    segments = [
+        {"text": "first", "start_ms": 0, "end_ms": 100},
+        {"text": "second", "start_ms": 1, "end_ms": 200},
+    ]
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"segments": segments, "keep_timing": True})
+        assert ws.receive_json() == {
+            "type": "segment",
+            "index": 0,
+            "offset_samples": 0,
+        }
+        assert ws.receive_bytes() == b"first"
+        # "first" — 5 байт, т.е. 2 сэмпла; до end_ms=100 (1600 сэмплов) — тишина
+        assert ws.receive_bytes() == b"\x00\x00" * 1598
+        # start_ms=1 уже пройден — второй сегмент идёт без паузы
+        assert ws.receive_json() == {
+            "type": "segment",
+            "index": 1,
+            "offset_samples": 1600,
+        }
+        assert ws.receive_bytes() == b"second"
+        assert ws.receive_bytes() == b"\x00\x00" * (3200 - 1603)
+        end_msg = ws.receive_json()
+        assert end_msg["type"] == "end"
+        assert set(end_msg["stats"]["timings"]) == {"first_audio", "segments"}
+
+
+@patch("gateway.app.main.websockets.connect")
+def test_ws_tts_upstream_error_counts_as_failed(mock_ws_connect):
+    mock_ws = AsyncMock()
+
+    async def fake_iter():
+        yield b"chunk"
+        yield '{"error": "synthesis crashed"}'
+
+    mock_ws.__aiter__.side_effect = lambda: fake_iter()
+    mock_ws_connect.return_value.__aenter__.return_value = mock_ws
+    failed_before = session_stats["failed"]
+    upstream_failures_before = main.tts_pool.upstreams[0].failures
+
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"text": "Hello"})
+        assert ws.receive_bytes() == b"chunk"
+        assert ws.receive_json() == {"error": "synthesis crashed"}
+
+    assert session_stats["failed"] == failed_before + 1
+    assert main.tts_pool.upstreams[0].failures == upstream_failures_before + 1
+
+
+@patch(
+    "gateway.app.main.websockets.connect",
+    side_effect=lambda *args, **kwargs: FakeSegmentTTS(),
+)
+def test_ws_tts_segments_failed_segment_marker(mock_ws_connect):
+    segments = [{"text": "broken"}, {"text": "second"}]
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"segments": segments})
+        assert ws.receive_json() == {
+            "type": "segment",
+            "index": 0,
+            "offset_samples": 0,
+            "error": "synthesis crashed",
+        }
+        assert ws.receive_json()["index"] == 1
+        assert ws.receive_bytes() == b"second"
+        assert ws.receive_json()["type"] == "end"
+
+
+def test_segments_buffer_bounded_by_window():
+    started = []
+
+    def connect(*args, **kwargs):
+        tts = FakeSegmentTTS()
+        started.append(tts)
+        return tts
+
+    async def consume():
+        segments = [{"text": f"seg{i}"} for i in range(6)]
+        stream = main.synthesize_segments(segments)
+        try:
+            assert (await stream.__anext__())["index"] == 0
+            # Клиент «завис» на первом сегменте: остальные не запускаются
+            await asyncio.sleep(0.1)
+            return len(started)
+        finally:
+            await stream.aclose()
+
+    with (
+        patch("gateway.app.main.websockets.connect", side_effect=connect),
+        patch.object(main, "TTS_SEGMENT_CONCURRENCY", 2),
+    ):
+        assert asyncio.run(consume()) == 2
+
+
+@patch(
+    "gateway.app.main.websockets.connect",
+    side_effect=lambda *args, **kwargs: FakeSegmentTTS(),
+)
+def test_ws_tts_segments_cancel_and_replace(mock_ws_connect):
+    completed_before = session_stats["completed"]
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"segments": [{"text": "slow"}]})
+        ws.send_json({"type": "replace", "text": "second"})
+        assert ws.receive_json() == {"type": "replaced"}
+        assert ws.receive_json()["index"] == 0
+        assert ws.receive_bytes() == b"second"
+        assert ws.receive_json()["type"] == "end"
+
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"segments": [{"text": "slow"}]})
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled"}
+        assert ws.receive_json()["type"] == "end"
+
+    assert session_stats["completed"] == completed_before + 2
+    assert session_stats["active"] == 0
+
+
+@patch(
+    "gateway.app.main.websockets.connect",
+    side_effect=lambda *args, **kwargs: FakeSegmentTTS(),
+)
+def test_ws_tts_segments_client_disconnect(mock_ws_connect):
+    abandoned_before = session_stats["abandoned"]
+    start = time.monotonic()
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"segments": [{"text": "slow"}]})
+    assert time.monotonic() - start < 2
+    assert session_stats["abandoned"] == abandoned_before + 1
+    assert session_stats["active"] == 0
+
+
+def test_segments_control_detects_disconnect():
+    class GoneClient:
+        async def receive_text(self):
+            raise WebSocketDisconnect()
+
+    async def run():
+        job = asyncio.create_task(asyncio.sleep(5))
+        try:
+            return await main.wait_segments_control(GoneClient(), job)
+        finally:
+            job.cancel()
+
+    assert asyncio.run(run()) == {"type": "disconnect"}
+
+
+@patch("gateway.app.main.websockets.connect")
+def test_ws_tts_client_error_does_not_eject_upstream(mock_ws_connect):
+    mock_ws = AsyncMock()
+    mock_ws.close_code = 1003
+
+    async def fake_iter():
+        yield '{"error": "text required"}'
+
+    mock_ws.__aiter__.side_effect = lambda: fake_iter()
+    mock_ws_connect.return_value.__aenter__.return_value = mock_ws
+    upstream = main.tts_pool.upstreams[0]
+    failures_before = upstream.failures
+    rejected_before = session_stats["rejected"]
+
+    for _ in range(main.UPSTREAM_MAX_FAILS + 1):
+        with client.websocket_connect("/ws/tts") as ws:
+            ws.send_json({"text": ""})
+            assert ws.receive_json() == {"error": "text required"}
+
+    assert upstream.failures == failures_before
+    assert upstream.available(time.monotonic())
+    assert session_stats["rejected"] == rejected_before + main.UPSTREAM_MAX_FAILS + 1
+
+
+@patch("gateway.app.main.websockets.connect")
+def test_ws_tts_binary_first_frame_is_rejected(mock_ws_connect):
+    rejected_before = session_stats["rejected"]
+
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_bytes(b"\x00\x01")
+        assert ws.receive_json() == {"error": "text required"}
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_text()
+        assert exc.value.code == main.CLOSE_UNSUPPORTED_DATA
+
+    mock_ws_connect.assert_not_called()
+    assert session_stats["rejected"] == rejected_before + 1
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+import requests
+from fastapi import FastAPI
+
+from common.autotune import autotune, load_or_tune, thread_grid
+from common.prefork import run_in_child, run_prefork
+from common.tracing import Trace, parse_server_timing
+
+
+def test_thread_grid_respects_cpu_count():
+    grid = thread_grid(4)
+    assert (1, 4) in grid and (4, 1) in grid and (2, 2) in grid
+    assert all(t * w <= 4 for t, w in grid)
+
+
+def test_autotune_picks_best_throughput_within_target():
+    def build(threads, workers):
+        # Больше потоков — быстрее, но (4, 1) нарушает цель по задержке
+        delay = {(1, 1): 0.02, (2, 1): 0.01, (4, 1): 0.05}[(threads, workers)]
+        return lambda: time.sleep(delay)
+
+    result = autotune(build, latency_target_ms=30, grid=[(1, 1), (2, 1), (4, 1)])
+    assert (result["threads"], result["workers"]) == (2, 1)
+    assert len(result["trials"]) == 3
+
+
+def test_load_or_tune_persists_and_reuses(tmp_path):
+    path = str(tmp_path / "tuning.json")
+    calls = []
+
+    def tune():
+        calls.append(1)
+        return {"threads": 2, "workers": 1}
+
+    first = load_or_tune(path, "key-a", tune)
+    second = load_or_tune(path, "key-a", tune)
+    assert first["source"] == "measured"
+    assert second["source"] == "saved"
+    assert len(calls) == 1
+    with open(path) as f:
+        assert json.load(f)["key"] == "key-a"
+
+    load_or_tune(path, "key-b", tune)
+    assert len(calls) == 2
+
+
+def test_trace_server_timing_roundtrip():
+    trace = Trace("gateway", "req-1")
+    with trace.span("asr"):
+        pass
+    trace.merge("asr", {"transcribe": 12.5})
+    timings = parse_server_timing(trace.server_timing())
+    assert set(timings) == {"asr", "asr.transcribe"}
+    assert timings["asr.transcribe"] == 12.5
+    assert trace.headers()["X-Request-ID"] == "req-1"
+
+
+class ThreadedModel:
+    """Имитация CTranslate2: инференс выполняет пул потоков, созданный
+    в конструкторе (после fork() в ребёнке этих потоков нет)."""
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            x, done = self.jobs.get()
+            done.put(x * 2)
+
+    def infer(self, x: int, timeout: float = 5.0) -> int:
+        done = queue.Queue()
+        self.jobs.put((x, done))
+        return done.get(timeout=timeout)
+
+
+def _fail(message: str):
+    raise ValueError(message)
+
+
+def test_run_in_child_returns_result_and_leaves_parent_clean():
+    threads_before = threading.active_count()
+    assert run_in_child(lambda: ThreadedModel().infer(21)) == 42
+    assert threading.active_count() == threads_before
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_in_child(lambda: _fail("boom"))
+
+
+def test_model_built_before_fork_hangs_in_child():
+    model = ThreadedModel()
+
+    def infer_in_child():
+        try:
+            return model.infer(1, timeout=0.5)
+        except queue.Empty:
+            return "hung"
+
+    assert run_in_child(infer_in_child) == "hung"
+
+
+def _prefork_app():
+    app = FastAPI()
+    state = {}
+
+    @app.get("/infer")
+    async def infer():
+        result = await asyncio.get_running_loop().run_in_executor(
+            None, state["model"].infer, 21
+        )
+        return {"result": result, "pid": os.getpid()}
+
+    def init_worker():
+        state["model"] = ThreadedModel()
+
+    return app, init_worker
+
+
+@contextmanager
+def prefork_server(app, **kwargs):
+    """Запускает ``run_prefork`` с двумя воркерами в отдельном процессе."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = multiprocessing.get_context("fork").Process(
+        target=run_prefork, args=(app, port, 2), kwargs={"host": "127.0.0.1", **kwargs}
+    )
+    server.start()
+
+    def get(path: str, count: int) -> list:
+        deadline = time.monotonic() + 20
+        results = []
+        while len(results) < count and time.monotonic() < deadline:
+            try:
+                r = requests.get(f"http://127.0.0.1:{port}{path}", timeout=5)
+                results.append(r.json())
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        assert len(results) == count
+        return results
+
+    try:
+        yield server, get
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(10)
+    assert server.exitcode == 0
+
+
+def test_prefork_workers_build_model_after_fork():
+    app, init_worker = _prefork_app()
+    with prefork_server(app, init_worker=init_worker) as (server, get):
+        results = get("/infer", 6)
+    assert all(r["result"] == 42 for r in results)
+    assert server.pid not in {r["pid"] for r in results}
+
+
+def _smaps_kb(address: int, length: int) -> dict:
+    """Сумма полей ``/proc/self/smaps`` (в кБ) по отображениям, которые
+    пересекают ``[address, address + length)``."""
+    fields, inside = {}, False
+    with open("/proc/self/smaps") as f:
+        for line in f:
+            parts = line.split()
+            head = parts[0]
+            if "-" in head and not head.endswith(":"):
+                start, end = (int(x, 16) for x in head.split("-"))
+                inside = start < address + length and address < end
+            elif inside and head.endswith(":") and parts[-1] == "kB":
+                fields[head[:-1]] = fields.get(head[:-1], 0) + int(parts[1])
+    return fields
+
+
+def test_prefork_workers_share_preloaded_weights():
+    app = FastAPI()
+    size = 32 * 1024 * 1024
+    model = {}
+
+    def preload():
+        # «Веса», загруженные в родителе до fork
+        model["weights"] = np.arange(size // 8, dtype=np.float64)
+
+    @app.get("/pages")
+    async def pages():
+        weights = model["weights"]
+        total = float(weights.sum())  # инференс только читает веса
+        smaps = _smaps_kb(weights.ctypes.data, weights.nbytes)
+        return {
+            "total": total,
+            "shared_kb": smaps["Shared_Clean"] + smaps["Shared_Dirty"],
+            "pid": os.getpid(),
+        }
+
+    with prefork_server(app, preload=preload) as (server, get):
+        results = get("/pages", 4)
+    for r in results:
+        assert r["total"] == float(np.arange(size // 8, dtype=np.float64).sum())
+        assert r["shared_kb"] >= 0.9 * size / 1024
@@ -2,12 +2,17 @@ import math
 import asyncio
 import json
 import os
+import re
 import time
-from typing import AsyncGenerator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, suppress
+from typing import AsyncGenerator, Callable, List, Optional
 import numpy as np
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
 from TTS.api import TTS
+from common.autotune import autotune, cpu_count, load_or_tune, thread_grid
 from common.logger import logger
+from common.tracing import Trace
 
 logger.info("Service started")
 
@@ -15,9 +20,36 @@ logger.info("Service started")
 SAMPLE_RATE = int(os.getenv("TTS_SR", "16000"))
 CHUNK_SAMPLES = int(os.getenv("TTS_CHUNK_SAMPLES", "640"))
 MODEL_NAME = os.getenv("TTS_MODEL", "tts_models/en/ljspeech/tacotron2-DDC")
+# Потоки пула инференса. Coqui TTS (Tacotron2) хранит состояние инференса в
+# self, поэтому одну модель нельзя вызывать из нескольких потоков: пул не
+# больше MAX_INFERENCE_WORKERS, параллелизм — через TTS_PROCESSES
+MAX_INFERENCE_WORKERS = 1
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "1"))
+if TTS_WORKERS > MAX_INFERENCE_WORKERS:
+    logger.warning(
+        f"TTS_WORKERS={TTS_WORKERS} is unsafe for a shared TTS model, "
+        f"using {MAX_INFERENCE_WORKERS}; scale with TTS_PROCESSES instead"
+    )
+    TTS_WORKERS = MAX_INFERENCE_WORKERS
+# Число pre-fork процессов (python -m app.main); модель загружается в
+# родителе, воркеры делят её веса через fork (copy-on-write)
+TTS_PROCESSES = int(os.getenv("TTS_PROCESSES", "1"))
+# Intra-op потоки torch (0 — по умолчанию torch)
+TTS_TORCH_THREADS = int(os.getenv("TTS_TORCH_THREADS", "0"))
+# Калибровка потоков при старте, результат кэшируется в TTS_TUNE_FILE
+TTS_AUTOTUNE = os.getenv("TTS_AUTOTUNE", "0") == "1"
+TTS_LATENCY_TARGET_MS = float(os.getenv("TTS_LATENCY_TARGET_MS", "1500"))
+TTS_TUNE_FILE = os.getenv("TTS_TUNE_FILE", "/opt/models/tts_tuning.json")
+CALIBRATION_TEXT = "The quick brown fox jumps over the lazy dog."
 
 app = FastAPI(title="tts-service", version="0.1.0")
 _tts = None
+# Пул для инференса: синтез не блокирует event loop, а ещё не начатые
+# задачи можно отменить при barge-in
+_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+_executor_workers = TTS_WORKERS
+_calibrated = False
+tuning = {"threads": TTS_TORCH_THREADS, "workers": TTS_WORKERS, "source": "env"}
 
 
 @app.middleware("http")
@@ -39,22 +71,125 @@ async def log_http_errors(request: Request, call_next):
     return response
 
 
+@app.on_event("startup")
+async def calibrate_on_startup():
+    if TTS_AUTOTUNE:
+        get_tts()
+
+
+def apply_threads(threads: int, workers: int):
+    """Задаёт intra-op потоки torch и размер пула инференса."""
+    global _executor, _executor_workers
+    workers = min(workers, MAX_INFERENCE_WORKERS)
+    if threads > 0:
+        import torch
+
+        torch.set_num_threads(threads)
+    if workers != _executor_workers:
+        _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts")
+        _executor_workers = workers
+
+
+def tune_threads(tts) -> dict:
+    def build(threads: int, workers: int):
+        apply_threads(threads, workers)
+        return lambda: tts.tts(text=CALIBRATION_TEXT)
+
+    # При pre-fork ядра делятся между процессами; модель одна на процесс,
+    # поэтому перебираются только потоки torch
+    cpus = max(1, cpu_count() // max(1, TTS_PROCESSES))
+    grid = [(t, w) for t, w in thread_grid(cpus) if w <= MAX_INFERENCE_WORKERS]
+    key = (
+        f"{MODEL_NAME}|cpus={cpus}|workers={MAX_INFERENCE_WORKERS}"
+        f"|target={TTS_LATENCY_TARGET_MS}"
+    )
+    return load_or_tune(
+        TTS_TUNE_FILE, key, lambda: autotune(build, TTS_LATENCY_TARGET_MS, grid)
+    )
+
+
+def calibrate(tune: Callable[[], dict]):
+    """Один раз за процесс применяет результат подбора потоков."""
+    global _calibrated
+    if _calibrated:
+        return
+    _calibrated = True
+    try:
+        tuning.update(tune())
+    except Exception as e:
+        logger.error(f"Thread autotune failed, using defaults: {e}")
+
+
+def load_tts():
+    return TTS(model_name=MODEL_NAME, progress_bar=False, gpu=False)
+
+
+def prepare_prefork():
+    """Загрузка модели в pre-fork родителе; воркеры делят её веса (CoW).
+
+    До fork не должен запуститься intra-op пул torch: с одним потоком
+    ``parallel_for`` выполняется в вызывающем потоке, а инференса в родителе
+    нет. Подбор потоков идёт в одноразовом процессе (он сам запускает пул);
+    воркеры наследуют ``tuning`` и применяют его в ``init_worker()``.
+    """
+    import torch
+
+    from common.prefork import run_in_child
+
+    global _tts
+    torch.set_num_threads(1)
+    try:
+        _tts = load_tts()
+    except Exception as e:
+        logger.error(f"Failed to load TTS model, using sine fallback: {e}")
+        _tts = False
+        return
+    if TTS_AUTOTUNE:
+        calibrate(lambda: run_in_child(lambda: tune_threads(_tts)))
+
+
+def init_worker():
+    """Настройка воркера после fork: свои потоки torch и пул инференса."""
+    threads = tuning["threads"] or max(1, cpu_count() // max(1, TTS_PROCESSES))
+    apply_threads(threads, tuning["workers"])
+
+
 def get_tts():
     global _tts
     if _tts is None:
         try:
-            _tts = TTS(model_name=MODEL_NAME, progress_bar=False, gpu=False)
+            _tts = load_tts()
         except Exception:
             _tts = False
+            return None
+        if TTS_AUTOTUNE:
+            calibrate(lambda: tune_threads(_tts))
+        apply_threads(tuning["threads"], tuning["workers"])
     return _tts if _tts is not False else None
 
 
-async def generate_sine_fallback(text: str) -> AsyncGenerator[bytes, None]:
+def split_sentences(text: str) -> List[str]:
+    """Разбивает текст на предложения — шаги синтеза, между которыми
+    проверяется отмена."""
+    parts = re.split(r"(?<=[.!?;])\s+", text.strip())
+    return [p for p in parts if p.strip()]
+
+
+def _is_cancelled(cancel: Optional[asyncio.Event]) -> bool:
+    return cancel is not None and cancel.is_set()
+
+
+async def generate_sine_fallback(
+    text: str, cancel: Optional[asyncio.Event] = None
+) -> AsyncGenerator[bytes, None]:
     duration = max(0.5, min(5.0, 0.07 * len(text)))
     total_samples = int(duration * SAMPLE_RATE)
     chunk_duration = CHUNK_SAMPLES / SAMPLE_RATE
 
     for i in range(0, total_samples, CHUNK_SAMPLES):
+        if _is_cancelled(cancel):
+            return
         chunk_size = min(CHUNK_SAMPLES, total_samples - i)
         chunk = bytearray()
         for j in range(chunk_size):
@@ -66,63 +201,205 @@ async def generate_sine_fallback(text: str) -> AsyncGenerator[bytes, None]:
         await asyncio.sleep(chunk_duration)
 
 
-async def generate_tts(text: str) -> AsyncGenerator[bytes, None]:
-    tts = get_tts()
+def model_sample_rate(tts) -> int:
+    """Частота дискретизации выхода модели (22050 Гц у моделей LJSpeech)."""
+    rate = getattr(getattr(tts, "synthesizer", None), "output_sample_rate", None)
+    return rate if isinstance(rate, int) and rate > 0 else 22050
+
+
+def synthesize_pcm(tts, text: str) -> bytes:
+    """Синтез одного предложения в PCM s16le (выполняется в пуле).
+
+    Ресемплинг к ``SAMPLE_RATE`` выполняется всегда, независимо от длины:
+    короткие предложения («Yes.») иначе попали бы в поток на частоте модели.
+    """
+    wav = tts.tts(text=text)
+    if not isinstance(wav, np.ndarray):
+        wav = np.asarray(wav, dtype=np.float32)
+    rate = model_sample_rate(tts)
+    if rate != SAMPLE_RATE and len(wav):
+        size = max(1, round(len(wav) * SAMPLE_RATE / rate))
+        indices = np.linspace(0, len(wav) - 1, size).astype(int)
+        wav = wav[indices]
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+async def synthesize_sentences(
+    tts, sentences: List[str], cancel: Optional[asyncio.Event], trace: Trace
+) -> AsyncGenerator[bytes, None]:
+    """PCM по предложениям; следующее синтезируется в пуле, пока отдаётся
+    текущее. Не начатая задача в пуле отменяется при закрытии генератора."""
+    loop = asyncio.get_running_loop()
+    pending = loop.run_in_executor(_executor, synthesize_pcm, tts, sentences[0])
+    try:
+        for idx in range(len(sentences)):
+            wait_start = time.perf_counter()
+            pcm = await pending
+            # Только время ожидания: синтез, перекрытый отдачей, сюда не входит
+            trace.record("synthesis", wait_start)
+            pending = None
+            if idx + 1 < len(sentences) and not _is_cancelled(cancel):
+                pending = loop.run_in_executor(
+                    _executor, synthesize_pcm, tts, sentences[idx + 1]
+                )
+            yield pcm
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def generate_tts(
+    text: str, cancel: Optional[asyncio.Event] = None, trace: Optional[Trace] = None
+) -> AsyncGenerator[bytes, None]:
+    """Стримит PCM по предложениям.
+
+    При выставленном ``cancel`` генерация останавливается между чанками
+    и между шагами синтеза. В ``trace`` пишутся этапы model_load, synthesis
+    и pacing.
+    """
+    trace = trace or Trace("tts")
+    with trace.span("model_load"):
+        tts = get_tts()
     if not tts:
-        async for chunk in generate_sine_fallback(text):
+        async for chunk in generate_sine_fallback(text, cancel):
             yield chunk
         return
 
+    sentences = split_sentences(text) or [text]
+    chunk_duration = CHUNK_SAMPLES / SAMPLE_RATE
     try:
-        wav = tts.tts(text=text)
-        if not isinstance(wav, np.ndarray):
-            wav = np.asarray(wav, dtype=np.float32)
-        if len(wav) > SAMPLE_RATE:
-            ratio = SAMPLE_RATE / 22050
-            indices = np.linspace(0, len(wav) - 1, int(len(wav) * ratio)).astype(int)
-            wav = wav[indices]
-
-        pcm = (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
-        chunk_duration = CHUNK_SAMPLES / SAMPLE_RATE
-        for i in range(0, len(pcm), CHUNK_SAMPLES * 2):
-            chunk = pcm[i : i + CHUNK_SAMPLES * 2]
-            if chunk:
-                yield chunk
-                await asyncio.sleep(chunk_duration)
+        async with aclosing(
+            synthesize_sentences(tts, sentences, cancel, trace)
+        ) as stream:
+            async for pcm in stream:
+                for i in range(0, len(pcm), CHUNK_SAMPLES * 2):
+                    if _is_cancelled(cancel):
+                        return
+                    chunk = pcm[i : i + CHUNK_SAMPLES * 2]
+                    if chunk:
+                        yield chunk
+                        with trace.span("pacing"):
+                            await asyncio.sleep(chunk_duration)
 
     except Exception:
-        async for chunk in generate_sine_fallback(text):
+        async for chunk in generate_sine_fallback(text, cancel):
             yield chunk
 
 
+def parse_text(payload: dict) -> str:
+    text = payload.get("text", "")
+    if not text and payload.get("segments"):
+        text = " ".join(seg.get("text", "") for seg in payload["segments"])
+    return text
+
+
+def parse_control(message: str) -> dict:
+    try:
+        control = json.loads(message)
+    except json.JSONDecodeError:
+        return {}
+    return control if isinstance(control, dict) else {}
+
+
+async def stream_utterance(
+    websocket: WebSocket, text: str, cancel: asyncio.Event, trace: Trace
+) -> int:
+    started = time.perf_counter()
+    chunk_count = 0
+    async for chunk in generate_tts(text, cancel, trace):
+        await websocket.send_bytes(chunk)
+        if not chunk_count:
+            trace.record("first_audio", started)
+        chunk_count += 1
+    trace.record("stream", started)
+    return chunk_count
+
+
+async def wait_for_control(
+    websocket: WebSocket, job: asyncio.Task, cancel: asyncio.Event
+) -> Optional[str]:
+    """Ждёт окончания фразы, принимая управляющие сообщения.
+
+    Возвращает ``None``, если фраза озвучена целиком, пустую строку при
+    ``cancel`` и новый текст при ``replace``.
+    """
+    receiver = None
+    try:
+        while not job.done():
+            if receiver is None:
+                receiver = asyncio.create_task(websocket.receive_text())
+            await asyncio.wait({job, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not receiver.done():
+                continue
+            control = parse_control(receiver.result())
+            receiver = None
+            kind = control.get("type")
+            if kind == "replace" and not parse_text(control).strip():
+                await websocket.send_text(json.dumps({"error": "text required"}))
+                continue
+            if kind in ("cancel", "replace"):
+                # Не ждём предложение, которое сейчас синтезируется в пуле:
+                # ответ клиенту уходит сразу, результат синтеза отбрасывается
+                cancel.set()
+                job.cancel()
+                with suppress(asyncio.CancelledError):
+                    await job
+                return parse_text(control) if kind == "replace" else ""
+        return None
+    finally:
+        if receiver is not None:
+            receiver.cancel()
+
+
 @app.websocket("/ws/tts")
 async def ws_tts(websocket: WebSocket):
+    """Стриминговый синтез.
+
+    Пока идёт отдача аудио, сервис слушает управляющие сообщения:
+    ``{"type": "cancel"}`` останавливает синтез (ответ ``{"type": "cancelled"}``
+    и ``{"type": "end"}``), ``{"type": "replace", "text": ...}`` прерывает
+    текущую фразу и начинает новую (ответ ``{"type": "replaced"}``).
+    """
     await websocket.accept()
     logger.info("WebSocket connection accepted")
+    trace = Trace.from_headers("tts", websocket.headers)
+    job = None
+    cancel = asyncio.Event()
     try:
         data = await websocket.receive_text()
-        payload = json.loads(data)
-        text = payload.get("text", "")
+        # Не-JSON отклоняется так же, как пустой текст (код 1003)
+        text = parse_text(parse_control(data))
 
-        if not text and payload.get("segments"):
-            text = " ".join(seg.get("text", "") for seg in payload["segments"])
         if not text.strip():
             logger.warning("Empty text received")
             await websocket.send_text(json.dumps({"error": "text required"}))
             await websocket.close(code=1003)
             return
 
-        logger.info(
-            f"Generating audio for text: '{text[:50]}{'...' if len(text) > 50 else ''}'"
-        )
-
-        chunk_count = 0
-        async for chunk in generate_tts(text):
-            await websocket.send_bytes(chunk)
-            chunk_count += 1
+        while True:
+            logger.info(
+                f"Generating audio for text: "
+                f"'{text[:50]}{'...' if len(text) > 50 else ''}'"
+            )
+            cancel = asyncio.Event()
+            job = asyncio.create_task(stream_utterance(websocket, text, cancel, trace))
+            next_text = await wait_for_control(websocket, job, cancel)
+            if next_text is None:
+                break
+            if not next_text:
+                logger.info("Synthesis cancelled by client")
+                await websocket.send_text(json.dumps({"type": "cancelled"}))
+                await websocket.send_text(
+                    json.dumps({"type": "end", "stats": trace.stats()})
+                )
+                return
+            logger.info("Synthesis replaced by client")
+            await websocket.send_text(json.dumps({"type": "replaced"}))
+            text = next_text
 
+        chunk_count = job.result()
         logger.info(f"Audio generation completed, sent {chunk_count} chunks")
-        await websocket.send_text(json.dumps({"type": "end"}))
+        await websocket.send_text(json.dumps({"type": "end", "stats": trace.stats()}))
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected by client")
     except Exception as e:
@@ -131,8 +408,34 @@ async def ws_tts(websocket: WebSocket):
             await websocket.send_text(json.dumps({"error": str(e)}))
         except Exception:
             pass
+    finally:
+        cancel.set()
+        if job is not None and not job.done():
+            job.cancel()
+        trace.finish()
+
+
+@app.get("/tuning")
+async def get_tuning():
+    return tuning
 
 
 @app.get("/healthz")
 async def healthz():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "worker": os.getenv("WORKER_ID", "0"),
+        "pid": os.getpid(),
+    }
+
+
+if __name__ == "__main__":
+    from common.prefork import run_prefork
+
+    run_prefork(
+        app,
+        port=int(os.getenv("TTS_PORT", "8082")),
+        workers=TTS_PROCESSES,
+        preload=prepare_prefork,
+        init_worker=init_worker,
+    )
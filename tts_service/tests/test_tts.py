@@ -1,6 +1,12 @@
+import json
+import sys
+import time
+
+import numpy as np
+
 from fastapi.testclient import TestClient
 from unittest.mock import patch, MagicMock
-from tts_service.app.main import app
+from tts_service.app.main import app, synthesize_pcm
 
 client = TestClient(app)
 
@@ -30,3 +36,108 @@ def test_ws_tts_empty_text():
         ws.send_json({"text": ""})
         msg = ws.receive_json()
         assert "error" in msg
+
+
+def _receive_until_text(ws):
+    while True:
+        msg = ws.receive()
+        if msg.get("text") is not None:
+            return msg["text"]
+
+
+@patch("tts_service.app.main.get_tts", return_value=None)
+def test_ws_tts_cancel(mock_get_tts):
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"text": "A long sentence " * 10})
+        assert ws.receive_bytes()
+        ws.send_json({"type": "cancel"})
+        assert '"cancelled"' in _receive_until_text(ws)
+        assert ws.receive_json().get("type") == "end"
+
+
+@patch("tts_service.app.main.get_tts", return_value=None)
+def test_ws_tts_replace(mock_get_tts):
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"text": "A long sentence " * 10})
+        assert ws.receive_bytes()
+        ws.send_json({"type": "replace", "text": "Hi"})
+        assert '"replaced"' in _receive_until_text(ws)
+        assert ws.receive_bytes()
+        assert json.loads(_receive_until_text(ws))["type"] == "end"
+
+
+@patch("tts_service.app.main.TTS")
+def test_ws_tts_end_carries_trace_stats(mock_tts_class):
+    mock_tts_class.return_value.tts.return_value = [0.0, 0.1, -0.1]
+
+    headers = {"X-Request-ID": "req-42"}
+    with client.websocket_connect("/ws/tts", headers=headers) as ws:
+        ws.send_json({"text": "Hello"})
+        end_msg = json.loads(_receive_until_text(ws))
+    assert end_msg["type"] == "end"
+    assert end_msg["stats"]["request_id"] == "req-42"
+    for stage in ("model_load", "first_audio", "stream"):
+        assert stage in end_msg["stats"]["timings"]
+
+
+def test_synthesize_pcm_resamples_short_sentences():
+    tts = MagicMock()
+    tts.synthesizer.output_sample_rate = 22050
+    tts.tts.return_value = np.zeros(11025, dtype=np.float32)  # 0.5 с
+
+    assert len(synthesize_pcm(tts, "Yes.")) == 8000 * 2
+
+    tts.synthesizer.output_sample_rate = 16000
+    assert len(synthesize_pcm(tts, "Yes.")) == 11025 * 2
+
+
+@patch("tts_service.app.main.get_tts")
+def test_ws_tts_cancel_does_not_wait_for_sentence(mock_get_tts):
+    def slow_tts(text):
+        time.sleep(1.0)
+        return np.zeros(16000, dtype=np.float32)
+
+    mock_get_tts.return_value.tts.side_effect = slow_tts
+    mock_get_tts.return_value.synthesizer.output_sample_rate = 16000
+
+    with client.websocket_connect("/ws/tts") as ws:
+        ws.send_json({"text": "One long sentence."})
+        start = time.monotonic()
+        ws.send_json({"type": "cancel"})
+        assert ws.receive_json() == {"type": "cancelled"}
+        elapsed = time.monotonic() - start
+        assert ws.receive_json()["type"] == "end"
+    assert elapsed < 0.5
+
+
+@patch("tts_service.app.main.TTS")
+def test_prepare_prefork_loads_model_without_inference(mock_tts_class):
+    from tts_service.app import main
+
+    fake_torch = MagicMock()
+    with (
+        patch.dict(sys.modules, {"torch": fake_torch}),
+        patch.object(main, "_tts", None),
+        patch.object(main, "TTS_AUTOTUNE", False),
+    ):
+        main.prepare_prefork()
+        # Модель в родителе для общих страниц, без запуска пула torch
+        assert main._tts is mock_tts_class.return_value
+        fake_torch.set_num_threads.assert_called_once_with(1)
+        mock_tts_class.return_value.tts.assert_not_called()
+
+
+def test_tune_threads_keeps_single_inference_worker():
+    from tts_service.app import main
+
+    def fake_autotune(build, target_ms, grid):
+        assert grid and all(workers == 1 for _, workers in grid)
+        build(0, 4)
+        assert main._executor_workers == 1
+        return {"threads": 1, "workers": 1}
+
+    with (
+        patch.object(main, "autotune", side_effect=fake_autotune),
+        patch.object(main, "load_or_tune", side_effect=lambda f, k, tune: tune()),
+    ):
+        assert main.tune_threads(MagicMock())["workers"] == 1